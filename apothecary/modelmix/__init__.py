@@ -12,42 +12,229 @@ flag_mix
 """
 
 
+import time as _time
 import logging
+import threading
 import sqlalchemy
 import sqlalchemy.types
 import sqlalchemy.orm
+import sqlalchemy.orm.attributes
+import sqlalchemy.event
 import sqlalchemy.ext.hybrid
 import sqlalchemy.ext.declarative
 
 import apothecary.util
+import apothecary.query
+import apothecary.snapshot
 
 
 logger = logging.getLogger(__name__)
 
-__all__ = ("id_mix", "IdMix", "ts_mix")
+__all__ = ("id_mix", "IdMix", "ts_mix", "flag_mix", "flag_filter",
+           "flag_ts_mix", "table_args")
+
+
+# Per class {key: setter} plans of `ConstructorMix`.
+_constructor_plans = {}
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Mapper, 'after_configured')
+def _reset_constructor_plans():
+    _constructor_plans.clear()
+
+
+def _class_attr(cls, key):
+    for base in cls.__mro__:
+        if key in base.__dict__:
+            return base.__dict__[key]
+
+
+def _constructor_plan(cls):
+    """Map each keyword `ConstructorMix` accepts to its setter; table
+    column keys and synonyms of properties.
+    """
+    plan = _constructor_plans.get(cls)
+    if plan is None:
+        plan = {}
+        mapper = sqlalchemy.inspect(cls)
+        for key, col in cls.__table__.columns.items():
+            attr = _class_attr(cls, key)
+            if attr is None:
+                attr = _class_attr(cls,
+                                   mapper.get_property_by_column(col).key)
+            plan[key] = attr.__set__
+        for key, attr in mapper.all_orm_descriptors.items():
+            if (key not in plan and
+                    isinstance(getattr(attr, 'descriptor', None), property)):
+                plan[key] = _class_attr(cls, key).__set__
+        _constructor_plans[cls] = plan
+    return plan
+
+
+def _fill_bulk_defaults(table, rows):
+    """Fill the column values missing from `rows` (dicts) that have a
+    vectorized `info['bulk_default']`, one call per column.
+    """
+    for col in table.columns:
+        default = col.info.get('bulk_default')
+        if default is not None:
+            missing = [row for row in rows if col.key not in row]
+            if missing:
+                for row, value in zip(missing, default(len(missing))):
+                    row[col.key] = value
 
 
 class ConstructorMix(object):
     """This sets column values using constructor keyword args.
+
+    Accepted keys are resolved once per class. Unknown keys are logged
+    and ignored, or raise `TypeError` if `__constructor_strict__`.
     """
+    __constructor_strict__ = False
+
     def __init__(self, *args, **kwa):
         """
         """
         cls = self.__class__
+        plan = _constructor_plans.get(cls) or _constructor_plan(cls)
         for key, val in kwa.items():
-            # Set primary attribute.
-            if self.__table__.columns.has_key(key):
-                setattr(self, key, val) # Set
-            # Set descriptor attribute.
-            elif hasattr(cls, key):
-                attr = getattr(cls, key)
-                if hasattr(attr, 'descriptor'):
-                    if isinstance(getattr(attr, 'descriptor'), property):
-                        setattr(self, key, val) # Set
+            setter = plan.get(key)
+            if setter is not None:
+                setter(self, val)
+            elif cls.__constructor_strict__ is True:
+                raise TypeError("`%s` is an invalid keyword argument for "
+                                "`%s`." % (key, cls.__name__))
             else:
-                # Raise here I think.
-                # kwa ignored.
-                logger.warning("Key `%s` was not found in model. Ignoring.")
+                logger.warning("Key `%s` was not found in model. Ignoring.",
+                               key)
+
+    @classmethod
+    def bulk_create(cls, session, rows, return_defaults=False,
+                    chunk_size=None):
+        """Insert dicts of column values with Core executemany INSERTs
+        without creating instances. Keys are checked like the
+        constructor's but must be table column keys.
+
+        Columns missing from a row get their `info['bulk_default']`
+        (a callable of the row count returning that many values, see
+        `ts_mix`/`record_token_mix`) in one pass per batch. Other Python
+        side defaults are applied by Core as usual.
+
+        `return_defaults` - Return the primary key tuples of the new
+                            rows in the order of `rows`.
+        `chunk_size` - Rows per executemany. Defaults to all of them.
+        """
+        mapper = sqlalchemy.inspect(cls)
+        table = mapper.local_table
+        plan = _constructor_plans.get(cls) or _constructor_plan(cls)
+
+        def checked(row):
+            values = {}
+            for key, val in row.items():
+                if key in table.columns:
+                    values[key] = val
+                elif key in plan:
+                    raise TypeError("`%s` can only be set on `%s` "
+                                    "instances." % (key, cls.__name__))
+                elif cls.__constructor_strict__ is True:
+                    raise TypeError("`%s` is an invalid keyword argument "
+                                    "for `%s`." % (key, cls.__name__))
+                else:
+                    logger.warning("Key `%s` was not found in model. "
+                                   "Ignoring.", key)
+            return values
+
+        bind_arguments = {'mapper': mapper}
+        dialect = session.get_bind(mapper=mapper).dialect
+        stmt = sqlalchemy.insert(table)
+        returning = return_defaults is True and getattr(dialect,
+                    'insert_executemany_returning_sort_by_parameter_order',
+                    False)
+        if returning:
+            stmt = stmt.returning(*table.primary_key,
+                                  sort_by_parameter_order=True)
+
+        results = []
+        rows = [checked(row) for row in rows]
+        for chunk in apothecary.query.chunked(rows, chunk_size or
+                                              len(rows) or 1):
+            _fill_bulk_defaults(table, chunk)
+
+            # executemany needs the same keys in every row.
+            shapes = {}
+            for i, row in enumerate(chunk):
+                shapes.setdefault(frozenset(row), []).append(i)
+            chunk_results = [None] * len(chunk)
+            for indexes in shapes.values():
+                params = [chunk[i] for i in indexes]
+                if return_defaults is True and not returning:
+                    # One statement per row for the inserted keys.
+                    for i in indexes:
+                        chunk_results[i] = tuple(session.execute(stmt,
+                                    chunk[i], bind_arguments=bind_arguments
+                                    ).inserted_primary_key)
+                    continue
+                result = session.execute(stmt, params,
+                                         bind_arguments=bind_arguments)
+                if returning:
+                    for i, pk in zip(indexes, result):
+                        chunk_results[i] = tuple(pk)
+            results.extend(chunk_results)
+
+        if return_defaults is True:
+            return results
+
+
+def table_args(cls, *args, **kwa):
+    """Build `__table_args__` from `args`, `kwa` and the items every
+    mixin in `cls` contributes through `__mix_table_args__`. Models that
+    declare their own `__table_args__` should return
+    `table_args(cls, ...)` from a `declared_attr` to keep mixin indexes.
+    """
+    items = list(args)
+    for base in reversed(cls.__mro__):
+        contribute = base.__dict__.get('__mix_table_args__')
+        if contribute is not None:
+            items.extend(contribute.__get__(None, cls)())
+    if kwa:
+        items.append(kwa)
+    return tuple(items)
+
+
+def _bulk_update(cls, session, values, criteria, pks=None, all=False,
+                 synchronize_session='auto'):
+    """Issue set-based `UPDATE`s of `values` for rows matching
+    `criteria` and, if given, primary keys `pks`. (Chunked to the
+    dialect's parameter limit.) Returns the number of rows matched.
+    Updating every row requires an explicit `all=True`.
+    """
+    if not criteria and pks is None and all is not True:
+        raise ValueError("Bulk updates of `%s` require criteria, `pks` or "
+                         "`all=True`." % cls.__name__)
+    stmt = sqlalchemy.update(cls).values(values)
+    if criteria:
+        stmt = stmt.where(*criteria)
+    stmt = stmt.execution_options(synchronize_session=synchronize_session)
+    if pks is None:
+        return session.execute(stmt).rowcount
+
+    mapper = sqlalchemy.inspect(cls)
+    pk_attrs = [getattr(cls, mapper.get_property_by_column(col).key)
+                    for col in mapper.primary_key]
+    dialect = session.get_bind(mapper=mapper).dialect
+    size = max(1, apothecary.query.param_limit(dialect) // len(pk_attrs))
+    rowcount = 0
+    for chunk in apothecary.query.chunked(pks, size):
+        if len(pk_attrs) == 1:
+            where = pk_attrs[0].in_(chunk)
+        else:
+            where = sqlalchemy.tuple_(*pk_attrs).in_(chunk)
+        rowcount += session.execute(stmt.where(where)).rowcount
+    return rowcount
+
+
+def _index_name(cls, *parts):
+    return '_'.join(('ix', cls.__tablename__) + parts)
 
 
 def id_mix(id_attr='id', id_col=None):
@@ -69,13 +256,23 @@ IdMix = id_mix()
 
 
 def ts_mix(ts_attr, ts_col=None, oncreate=False, onupdate=False, defer=False,
-          timefunc=apothecary.util.time, Type=sqlalchemy.types.Integer):
+          timefunc=apothecary.util.time, Type=sqlalchemy.types.Integer,
+          nullable=None, server_side=False, defer_group='audit'):
     """
     `ts_col` - Column name for created timestamp.
     `oncreate` -
     `onupdate` -
+    `nullable` - Defaults to nullable unless `oncreate` or `onupdate`.
+    `server_side` - Let the database set `oncreate`/`onupdate` times
+                    (`server_default` and a SQL `onupdate` expression)
+                    rather than calling `timefunc` per row. Integer
+                    columns get UNIX time, other types
+                    CURRENT_TIMESTAMP. Inserted values are fetched by
+                    RETURNING where the dialect has it.
     `defer` - Defer loading of the columns to access time rather
               than at query.
+    `defer_group` - Defer group of the column. (See
+                    `apothecary.query.undefer_groups`)
     `timefunc` - 
     `Type` -
     """
@@ -96,21 +293,51 @@ def ts_mix(ts_attr, ts_col=None, oncreate=False, onupdate=False, defer=False,
         def _set_now(self):
             self._ts = timefunc()
 
+        @classmethod
+        def _bulk_set_now(cls, session, *criteria, **kwa):
+            """Set the timestamp to now with one `UPDATE` for rows
+            matching `criteria` and/or `pks=[...]`, or every row with
+            `all=True`.
+            """
+            return _bulk_update(cls, session, {ts_attr: timefunc()},
+                                criteria, **kwa)
+
     def col(**col_kwa):
         # Create the Column object with various options.
-        if oncreate is True:
-            col_kwa['default'] = timefunc
-        if onupdate is True:
-            col_kwa['default'] = timefunc #??
-            col_kwa['onupdate'] = timefunc
-        col_kwa['nullable'] = not(oncreate or onupdate)
+        if server_side is True:
+            if issubclass(sqlalchemy.types.to_instance(Type)._type_affinity,
+                          sqlalchemy.types.Integer):
+                now = apothecary.util.epoch_now()
+            else:
+                now = sqlalchemy.func.current_timestamp()
+            if oncreate is True or onupdate is True:
+                col_kwa['server_default'] = now
+            if onupdate is True:
+                col_kwa['onupdate'] = now
+        else:
+            if oncreate is True:
+                col_kwa['default'] = timefunc
+            if onupdate is True:
+                col_kwa['default'] = timefunc #??
+                col_kwa['onupdate'] = timefunc
+            if oncreate is True or onupdate is True:
+                # Vectorized default for `ConstructorMix.bulk_create`.
+                col_kwa['info'] = {'bulk_default': lambda n: [timefunc()] * n}
+        if nullable is None:
+            col_kwa['nullable'] = not(oncreate or onupdate)
+        else:
+            col_kwa['nullable'] = nullable
         return sqlalchemy.Column(ts_col, Type, **col_kwa)
 
     setattr(TsMix, '_'.join([ts_attr, 'set_now']), TsMix._set_now)
+    setattr(TsMix, '_'.join(['bulk', ts_attr, 'set_now']),
+            TsMix.__dict__['_bulk_set_now'])
 
     if defer is True:
         # Defer loading of column.
-        setattr(TsMix, ts_attr, sqlalchemy.orm.defered(col()))
+        setattr(TsMix, ts_attr, sqlalchemy.ext.declarative.declared_attr(
+                    lambda cls: sqlalchemy.orm.deferred(col(),
+                                                        group=defer_group)))
     else:
         # Eager (?) loading of column.
         setattr(TsMix, ts_attr, col())
@@ -119,11 +346,50 @@ TsUpdatedMix = ts_mix('ts_updated', onupdate=True)
 TsCreatedMix = ts_mix('ts_created', oncreate=True)
 
 
-def flag_mix(flag_col, default=False, invert_filter=False,
-            Type=sqlalchemy.types.Boolean):
+# (FlagMix, flag_col) of every flag.
+_flag_mixes = []
+# (FlagMix, flag_col, visible value) of every auto filtering flag.
+_flag_filters = []
+# One loader criteria option per auto filtering flag. Each applies to
+#   every mapped subclass of its FlagMix.
+_flag_filter_options = []
+
+
+def _flag_filter_option(FlagMix, flag_col, visible):
+    # The lambda is cached by its code and tracked closure values; close
+    #   over a column element (not the bare name) so each flag gets its
+    #   own cache entry.
+    flag = sqlalchemy.column(flag_col, sqlalchemy.types.Boolean)
+    return sqlalchemy.orm.with_loader_criteria(FlagMix,
+                        lambda cls: getattr(cls, flag.key) == visible,
+                        include_aliases=True, propagate_to_loaders=False)
+
+
+def filter_flags(orm_execute_state):
+    """`do_orm_execute` listener adding the `flag_mix` filters to every
+    SELECT, including subqueries and relationship loads. Opt out per
+    statement with `.execution_options(flag_filter=False)`.
+    """
+    if (_flag_filter_options and
+            orm_execute_state.is_select and
+            not orm_execute_state.is_column_load and
+            orm_execute_state.execution_options.get('flag_filter', True)):
+        orm_execute_state.statement = (orm_execute_state.statement
+                                            .options(*_flag_filter_options))
+
+
+def flag_filter(target):
+    """Filter SELECTs executed by `target` (a Session, sessionmaker,
+    scoped_session or the Session class) by `flag_mix` flags.
+    """
+    sqlalchemy.event.listen(target, 'do_orm_execute', filter_flags)
+
+
+def flag_mix(flag_col, default=False, invert_filter=False, auto_filter=False,
+            index=False, partial_index=False, Type=sqlalchemy.types.Boolean):
     """Allows for the arbitrary creation of flag (boolean) attributes.
-    Queries are automatically filtered based on the flag when coupled
-    with .unique_constructor, .query_filters, or .rebase metaclass.
+    Queries can be automatically filtered based on the flag when the
+    session is set up with `flag_filter`. (See `auto_filter`)
 
     `flag_col` - the name of the flag attribute.
         This is also doubles as the table column name unless
@@ -136,10 +402,23 @@ def flag_mix(flag_col, default=False, invert_filter=False,
     `invert_filter` - This inverts the filter from expecting a True
         value to Fale.
 
+    `auto_filter` - Filter queries by this flag under `flag_filter`.
+        (On for `ActiveMix` and `DeletableMix`.) The filter compares to a SQL boolean literal (`flag = true`,
+        `flag = 0`) so a partial index on the same condition can serve
+        it.
+
+    `index` - Index the flag column.
+
+    `partial_index` - Create an index limited to the rows that pass
+        the filter. (PostgreSQL/SQLite `WHERE flag`) Either True or a
+        tuple of column names to index. (Defaults to the flag column.)
+
     `Type` - The SQLAlchemy type to use for the column.
     """
     # Removed the confusion of `inverse`. Replaced with `invert_filter`
     # Removed col_name.
+    visible = sqlalchemy.false() if invert_filter else sqlalchemy.true()
+
     class FlagMix(object):
         """ """
         @sqlalchemy.ext.hybrid.hybrid_property
@@ -157,26 +436,91 @@ def flag_mix(flag_col, default=False, invert_filter=False,
         def _unset_flag(self):
             self._flag = False
 
-        @property
+        @classmethod
+        def _bulk_set_flag(cls, session, *criteria, **kwa):
+            """Set the flag with one `UPDATE` for rows matching
+            `criteria` and/or `pks=[...]`.
+            """
+            return _bulk_update(cls, session, {flag_col: True}, criteria,
+                                **kwa)
+
+        @classmethod
+        def _bulk_unset_flag(cls, session, *criteria, **kwa):
+            """Unset the flag with one `UPDATE` for rows matching
+            `criteria` and/or `pks=[...]`.
+            """
+            return _bulk_update(cls, session, {flag_col: False}, criteria,
+                                **kwa)
+
+        @sqlalchemy.ext.hybrid.hybrid_property
         def __filter__(self):
-            return self._flag is False if invert_filter else True
+            """Whether the row passes the flag filter. SQL criterion at
+            the class level."""
+            return getattr(self, flag_col) is not invert_filter
+
+        @__filter__.expression
+        def __filter__(cls):
+            return getattr(cls, flag_col) == visible
 
     def col():
         return sqlalchemy.Column(sqlalchemy.types.Boolean, default=default,
-                                 nullable=False)
+                                 nullable=False, index=index is True)
+
+    if partial_index:
+        columns = (flag_col,) if partial_index is True else tuple(partial_index)
+
+        def mix_table_args(cls):
+            return [_partial_index(cls, columns, flag_col, visible)]
+        FlagMix.__mix_table_args__ = classmethod(mix_table_args)
+        FlagMix.__table_args__ = sqlalchemy.ext.declarative.declared_attr(
+                                    table_args)
 
     setattr(FlagMix, '_'.join(['set', flag_col]), FlagMix._set_flag)
     setattr(FlagMix, '_'.join(['unset', flag_col]), FlagMix._unset_flag)
+    setattr(FlagMix, '_'.join(['bulk_set', flag_col]),
+            FlagMix.__dict__['_bulk_set_flag'])
+    setattr(FlagMix, '_'.join(['bulk_unset', flag_col]),
+            FlagMix.__dict__['_bulk_unset_flag'])
     setattr(FlagMix, flag_col, col())
 
-    return FlagMix
-ActiveMix = flag_mix('active')
-DeletableMix = flag_mix('deleted', default=False, invert_filter=True)
+    _flag_mixes.append((FlagMix, flag_col))
+    if auto_filter is True:
+        _flag_filters.append((FlagMix, flag_col, visible))
+        _flag_filter_options.append(_flag_filter_option(FlagMix, flag_col,
+                                                        visible))
 
-
-def flag_ts_mix(flag_col, ts_col, default_flag=False, timefunc=apothecary.util.time):
-    FlagMix = flag_mix(flag_col, default=default_flag)
-    TsMix = ts_mix(ts_col, timefunc=timefunc, oncreate=default_flag is True)
+    return FlagMix
+ActiveMix = flag_mix('active', auto_filter=True)
+DeletableMix = flag_mix('deleted', default=False, invert_filter=True,
+                        auto_filter=True)
+
+
+def _partial_index(cls, columns, flag_col, visible, ts_col=None):
+    where = sqlalchemy.column(flag_col, sqlalchemy.types.Boolean) == visible
+    return sqlalchemy.Index(_index_name(cls, *columns + ('partial',)),
+                            *columns, postgresql_where=where,
+                            sqlite_where=where,
+                            info={'flag': flag_col, 'ts': ts_col,
+                                  'partial': True})
+
+
+def flag_ts_mix(flag_col, ts_col, default_flag=False, invert_filter=False,
+                auto_filter=False, index=False, partial_index=False,
+                timefunc=apothecary.util.time):
+    """Flag with a timestamp of when it was set.
+
+    `auto_filter` - See `flag_mix`. Pass True for visibility flags.
+    `index` - Composite (flag, ts) index for queries filtering on the
+        flag and ordering by the timestamp.
+    `partial_index` - Index the timestamp limited to the rows that pass
+        the flag filter.
+    """
+    FlagMix = flag_mix(flag_col, default=default_flag,
+                       invert_filter=invert_filter, auto_filter=auto_filter)
+    # Unsetting the flag clears the timestamp.
+    TsMix = ts_mix(ts_col, timefunc=timefunc, oncreate=default_flag is True,
+                   nullable=True)
+    visible = sqlalchemy.false() if invert_filter else sqlalchemy.true()
 
     class FlagTsMix(FlagMix, TsMix):
         """
@@ -196,10 +540,82 @@ def flag_ts_mix(flag_col, ts_col, default_flag=False, timefunc=apothecary.util.t
             else:
                 setattr(self, ts_col, None)
 
+        # Keep the timestamp consistent as `_flag` does.
+        @classmethod
+        def _bulk_set_flag(cls, session, *criteria, **kwa):
+            return _bulk_update(cls, session,
+                                {flag_col: True, ts_col: timefunc()},
+                                criteria, **kwa)
+
+        @classmethod
+        def _bulk_unset_flag(cls, session, *criteria, **kwa):
+            return _bulk_update(cls, session, {flag_col: False, ts_col: None},
+                                criteria, **kwa)
+
+    setattr(FlagTsMix, '_'.join(['bulk_set', flag_col]),
+            FlagTsMix.__dict__['_bulk_set_flag'])
+    setattr(FlagTsMix, '_'.join(['bulk_unset', flag_col]),
+            FlagTsMix.__dict__['_bulk_unset_flag'])
+
+    if index or partial_index:
+        def mix_table_args(cls):
+            items = []
+            if index:
+                items.append(sqlalchemy.Index(
+                                _index_name(cls, flag_col, ts_col),
+                                flag_col, ts_col,
+                                info={'flag': flag_col, 'ts': ts_col,
+                                      'partial': False}))
+            if partial_index:
+                items.append(_partial_index(cls, (ts_col,), flag_col,
+                                            visible, ts_col=ts_col))
+            return items
+        FlagTsMix.__mix_table_args__ = classmethod(mix_table_args)
+        FlagTsMix.__table_args__ = sqlalchemy.ext.declarative.declared_attr(
+                                    table_args)
+
     return FlagTsMix
 
 
+def flag_index_coverage(cls):
+    """Report the flag/ts queries each index of `cls` can serve.
+    Returns a list of (index name, [query description, ...]).
+    """
+    report = []
+    for index in cls.__table__.indexes:
+        columns = [col.name for col in index.columns]
+        flag_col = index.info.get('flag')
+        ts_col = index.info.get('ts')
+        covers = []
+        if flag_col is None and len(columns) == 1:
+            # Plain `index=True` flag columns.
+            if any(issubclass(cls, FlagMix) and name == columns[0]
+                        for FlagMix, name in _flag_mixes):
+                flag_col = columns[0]
+        if flag_col is None:
+            report.append((index.name, covers))
+            continue
+        if index.info.get('partial'):
+            covers.append("WHERE %s (filter)" % flag_col)
+            if columns[0] == ts_col:
+                covers.append("WHERE %s (filter) ORDER BY %s" %
+                                    (flag_col, ts_col))
+        elif columns[0] == flag_col:
+            covers.append("WHERE %s = ?" % flag_col)
+            if columns[1:2] == [ts_col]:
+                covers.append("WHERE %s = ? ORDER BY %s" % (flag_col, ts_col))
+                covers.append("WHERE %s = ? AND %s > ?" % (flag_col, ts_col))
+        report.append((index.name, covers))
+    return report
+
+
 def sequence_mix(sequence_col, default=0, index=True):
+    """
+    Persistent objects are incremented in the database with
+    `UPDATE ... SET seq = seq + :n RETURNING seq` so concurrent writers
+    never lose updates. Adds `reserve_[sequence_col](n)` to allocate a
+    block of values.
+    """
     class SequenceMix(object):
         """Base Sequence mixin class """
         
@@ -212,21 +628,81 @@ def sequence_mix(sequence_col, default=0, index=True):
             assert isinstance(value, int), "`value` must be an integer."
             setattr(self, sequence_col, value)
 
+        def _sequence_add(self, n):
+            """Add `n` to the sequence and return the new value."""
+            session = sqlalchemy.orm.object_session(self)
+            if session is None or sqlalchemy.inspect(self).key is None:
+                # Not in the database yet.
+                current = self._sequence
+                self._sequence = (default if current is None else current) + n
+                return self._sequence
+
+            cls = self.__class__
+            mapper = sqlalchemy.inspect(cls)
+            column = getattr(cls, sequence_col)
+            where = [getattr(cls, mapper.get_property_by_column(col).key) == val
+                        for col, val in zip(mapper.primary_key,
+                                    mapper.primary_key_from_instance(self))]
+            stmt = (sqlalchemy.update(cls).where(*where)
+                        .values({sequence_col: sqlalchemy.func.coalesce(
+                                                    column, default) + n})
+                        .execution_options(synchronize_session=False))
+            dialect = session.get_bind(mapper=mapper).dialect
+            if getattr(dialect, 'update_returning', False):
+                value = session.execute(stmt.returning(column)).scalar_one()
+            else:
+                # The UPDATE holds the row lock until the transaction ends.
+                session.execute(stmt)
+                value = session.execute(sqlalchemy.select(column)
+                                            .where(*where)).scalar_one()
+            sqlalchemy.orm.attributes.set_committed_value(self, sequence_col,
+                                                          value)
+            return value
+
         def _sequence_inc(self):
-            self._sequence += 1
+            return self._sequence_add(1)
 
         def _sequence_dec(self):
-            self._sequence -= 1
+            return self._sequence_add(-1)
+
+        def _sequence_reserve(self, n):
+            """Reserve a block of `n` values. Returns them as a range."""
+            value = self._sequence_add(n)
+            return range(value - n + 1, value + 1)
 
     def col(**kwa):
         return sqlalchemy.Column(sqlalchemy.types.Integer, index=index,
                                  nullable=True, default=default)
 
     setattr(SequenceMix, sequence_col, col())
+    setattr(SequenceMix, '_'.join(['reserve', sequence_col]),
+            SequenceMix._sequence_reserve)
     return SequenceMix
 SequenceMix = sequence_mix('sequence')
 
 
+# Preloaded lookup tables. {cls: (rows, expires, generation)}
+#   Entries are replaced whole, so hits read them without a lock.
+_lookup_caches = {}
+_lookup_empty = (None, 0, 0)
+# Guards generation updates and `_lookup_load_locks`; never held while
+#   querying.
+_lookup_lock = threading.Lock()
+# {cls: lock held while loading that table}
+_lookup_load_locks = {}
+
+
+def _lookup_fresh(entry):
+    rows, expires, generation = entry
+    return rows is not None and (expires is None or
+                                 expires > _time.monotonic())
+
+
+def _lookup_load_lock(cls):
+    with _lookup_lock:
+        return _lookup_load_locks.setdefault(cls, threading.RLock())
+
+
 def lookup_mix(key_col='key', value_col='desc', ext_col=None,
                index_name=True, key_len=32, value_len=160, ext_len=1024):
     """Provides a simple 'key', 'value', and optionally 'extended'
@@ -235,10 +711,71 @@ def lookup_mix(key_col='key', value_col='desc', ext_col=None,
     'key' is always required and indexed by default.
     'value' and 'extended value' expect Unicode and are
         nullable.
+    `get`/`get_many` read a process wide copy of the table, loaded on
+    first use and dropped after `__lookup_ttl__` seconds (None to keep
+    it) or when a commit (or rollback) changes the table.
     """
+    columns = [key_col, value_col] + ([ext_col] if ext_col else [])
+
     class LookupMix(object):
         """Base Simple Lookup model"""
-        pass
+        __lookup_ttl__ = 300
+
+        @classmethod
+        def _lookup_rows(cls, session):
+            """Return the cached {key: row} of the table, loading the
+            whole table when missing or expired.
+            """
+            entry = _lookup_caches.get(cls, _lookup_empty)
+            if _lookup_fresh(entry):
+                return entry[0]
+            # One load per table at a time; other tables are unaffected.
+            with _lookup_load_lock(cls):
+                entry = _lookup_caches.get(cls, _lookup_empty)
+                if _lookup_fresh(entry):
+                    return entry[0]
+                generation = entry[2]
+                apothecary.util.on_commit_change(cls, cls.invalidate)
+                result = session.execute(sqlalchemy.select(
+                            *(getattr(cls, col) for col in columns)))
+                rows = dict((row[0], row) for row in result)
+                ttl = cls.__lookup_ttl__
+                with _lookup_lock:
+                    # Skip storing if invalidated while loading.
+                    if _lookup_caches.get(cls, _lookup_empty)[2] == generation:
+                        _lookup_caches[cls] = (rows,
+                                ttl and _time.monotonic() + ttl, generation)
+                return rows
+
+        @classmethod
+        def invalidate(cls):
+            """Drop the cached table. The next lookup reloads it."""
+            with _lookup_lock:
+                generation = _lookup_caches.get(cls, _lookup_empty)[2]
+                _lookup_caches[cls] = (None, 0, generation + 1)
+
+        @classmethod
+        def get(cls, session, key, default=None):
+            """Return the row of `key` from the process wide cache.
+            Rows are plain (key, value[, ext]) tuples, not model
+            instances, so they may be shared between sessions.
+            """
+            return cls._lookup_rows(session).get(key, default)
+
+        @classmethod
+        def get_many(cls, session, keys, default=None):
+            """Return the rows of `keys` in order."""
+            rows = cls._lookup_rows(session)
+            return [rows.get(key, default) for key in keys]
+
+        @classmethod
+        def dump_snapshot(cls, session, path):
+            """Write the table to a memory mapped snapshot at `path`.
+            Read it with `apothecary.snapshot.LookupSnapshot`.
+            """
+            result = session.execute(sqlalchemy.select(
+                        *(getattr(cls, col) for col in columns)))
+            apothecary.snapshot.write_snapshot(path, result)
 
     setattr(LookupMix, key_col,
                 sqlalchemy.Column(sqlalchemy.types.String(length=key_len),
@@ -316,7 +853,17 @@ class UniqueMix(object):
     """
     author: Michael Bayer
     src: https://bitbucket.org/zzzeek/sqlalchemy/wiki/UsageRecipes/UniqueObject
+
+    `__unique_cache_size__` - Bound of the per session cache.
+    `__unique_cache__` - Optional `apothecary.util.UniqueCache(shared=True)`
+                         shared by all sessions.
+    `__unique_attrs__` - Attribute names the unique args are stored in.
+                         Required by `as_unique_many`.
     """
+    __unique_cache_size__ = 10000
+    __unique_cache__ = None
+    __unique_attrs__ = None
+
     @classmethod
     def unique_hash(cls, *arg, **kw):
         raise NotImplementedError()
@@ -333,5 +880,27 @@ class UniqueMix(object):
                     cls.unique_hash,
                     cls.unique_filter,
                     cls,
-                    arg, kw
-               )
\ No newline at end of file
+                    arg, kw,
+                    maxsize=cls.__unique_cache_size__,
+                    shared=cls.__unique_cache__
+               )
+
+    @classmethod
+    def as_unique_many(cls, session, items, chunk_size=None, upsert=False):
+        """Resolve many unique objects with one query per chunk.
+        `items` are dicts of keyword args or tuples ordered as
+        `__unique_attrs__`. `unique_hash` is called with keyword args.
+        """
+        assert cls.__unique_attrs__, "`as_unique_many` requires `__unique_attrs__`."
+        return apothecary.util.unique_many(
+                    session,
+                    cls,
+                    cls.unique_hash,
+                    cls.__unique_attrs__,
+                    cls,
+                    items,
+                    chunk_size=chunk_size,
+                    upsert=upsert,
+                    maxsize=cls.__unique_cache_size__,
+                    shared=cls.__unique_cache__
+               )
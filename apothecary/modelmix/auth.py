@@ -1,15 +1,24 @@
 """Authentication Model Mixins.
 """
+import hmac
 import math
 import base64
+import asyncio
+import weakref
+import threading
+import sqlalchemy.event
+import sqlalchemy.orm.attributes
 import sqlalchemy.ext.hybrid
 import sqlalchemy.ext.declarative
 
 import apothecary.modelmix
 import apothecary.util
+import apothecary.query
 
 
-__all__ = ("user_mix", "group_mix", "permission_mix")
+__all__ = ("user_mix", "group_mix", "permission_mix", "user_group_mix",
+           "group_permission_mix", "user_permission_mix",
+           "load_effective_permissions", "PermissionIndex")
 
 try:
     _basestring = basestring
@@ -17,16 +26,46 @@ except NameError:
     _basestring = str
 
 
+def _provision_hashes(hashfunc, passhashfunc, names, passwords, salts):
+    """Hash one batch for `UserMix.provision`. Module level so process
+    pools can pickle it.
+    """
+    return ([hashfunc(name) for name in names],
+            [passhashfunc(password, salt)
+                for password, salt in zip(passwords, salts)])
+
+
 def user_mix(name_attr="name", name_col=None, name_size=32, index_name=False,
          namehash_attr="namehash", namehash_col=None,
          passhash_attr="passhash", passhash_col=None,
          salt_col="salt", salt_size=8,
          hashfunc=apothecary.util.hash,
+         passhashfunc=None,
          binary_encode=False,
-         basefunc=apothecary.util.benc):
+         basefunc=apothecary.util.benc,
+         executor=None,
+         defer=False, defer_group="security",
+         name_cache_size=10000, known_name_ttl=300, unknown_name_ttl=60):
     """Create a User Model Mixin.
+
+    `hashfunc` - Hash callable or profile name used for the name hash.
+    `passhashfunc` - Hash callable or profile name used for the
+                     password hash. (eg. "password") Defaults to
+                     `hashfunc`.
+    `executor` - Executor for the `_async`/`_many` variants. Defaults to
+                 `apothecary.util.hash_executor()`.
+    `defer` - Defer loading the namehash, passhash and salt columns
+              until accessed.
+    `defer_group` - Defer group of those columns. (See
+                    `apothecary.query.undefer_groups`)
+    `name_cache_size` - Bound of the `get_by_name` caches.
+    `known_name_ttl` - Seconds a name -> primary key entry is kept by
+                       `get_by_name`.
+    `unknown_name_ttl` - Seconds an unknown name is remembered by
+                         `get_by_name`.
     """
-    assert callable(hashfunc), "`hashfunc` must be callable."
+    hashfunc = apothecary.util.hash_profile(hashfunc)
+    passhashfunc = apothecary.util.hash_profile(passhashfunc or hashfunc)
     assert callable(basefunc), "`basefunc` must be callable."
 
     name_col = name_col or name_attr
@@ -35,6 +74,8 @@ def user_mix(name_attr="name", name_col=None, name_size=32, index_name=False,
 
     hash_size = hashfunc.digest_length
     hash_benc_size = basefunc.overhead(hash_size)
+    passhash_size = passhashfunc.digest_length
+    passhash_benc_size = basefunc.overhead(passhash_size)
     salt_benc_size = basefunc.overhead(salt_size)
 
     def encode(value):
@@ -47,6 +88,33 @@ def user_mix(name_attr="name", name_col=None, name_size=32, index_name=False,
             return basefunc.decode(value)
         return value
 
+    if binary_encode is True:
+        namehash_type = sqlalchemy.types.String(hash_benc_size)
+        passhash_type = sqlalchemy.types.String(passhash_benc_size)
+        salt_type = sqlalchemy.types.String(salt_benc_size)
+    else:
+        namehash_type = sqlalchemy.types.LargeBinary(hash_size)
+        passhash_type = sqlalchemy.types.LargeBinary(passhash_size)
+        salt_type = sqlalchemy.types.LargeBinary(salt_size)
+
+    def security_col(*args, **kwa):
+        if defer is True:
+            return apothecary.util.deferred(*args, group=defer_group, **kwa)
+        return sqlalchemy.Column(*args, **kwa)
+
+    mix_executor = executor
+
+    def get_executor(override):
+        return override or mix_executor or apothecary.util.hash_executor()
+
+    # `get_by_name` caches of (cls, namehash) -> primary key and of
+    #   unknown (cls, namehash), plus its statement per class.
+    known_names = apothecary.util.Cache(maxsize=name_cache_size,
+                                        ttl=known_name_ttl)
+    unknown_names = apothecary.util.Cache(maxsize=name_cache_size,
+                                          ttl=unknown_name_ttl)
+    name_statements = {}
+
     class UserMix(object):
         """User Model Mixin.
         """
@@ -55,22 +123,10 @@ def user_mix(name_attr="name", name_col=None, name_size=32, index_name=False,
                     sqlalchemy.types.Unicode(length=name_size),
                     index=index_name is True, nullable=False)
 
-        if binary_encode is True:
-            __namehash = sqlalchemy.Column(namehash_col,
-                            sqlalchemy.types.String(hash_benc_size),
-                            index=True, unique=True)
-            __passhash = sqlalchemy.Column(passhash_col,
-                            sqlalchemy.types.String(hash_benc_size))
-            __salt = sqlalchemy.Column(salt_col,
-                            sqlalchemy.types.String(salt_benc_size))
-        else:
-            __namehash = sqlalchemy.Column(namehash_col,
-                            sqlalchemy.types.LargeBinary(hash_size),
-                            index=True, unique=True)
-            __passhash = sqlalchemy.Column(passhash_col,
-                            sqlalchemy.types.LargeBinary(hash_size))
-            __salt = sqlalchemy.Column(salt_col,
-                            sqlalchemy.types.LargeBinary(salt_size))
+        __namehash = security_col(namehash_col, namehash_type,
+                                  index=True, unique=True)
+        __passhash = security_col(passhash_col, passhash_type)
+        __salt = security_col(salt_col, salt_type)
 
         @property
         def _name(self):
@@ -107,12 +163,176 @@ def user_mix(name_attr="name", name_col=None, name_size=32, index_name=False,
 
         @password.setter
         def password(self, value):
-            self.__passhash = encode(hashfunc(value.encode(), self._salt))
+            self.__passhash = encode(passhashfunc(value.encode(), self._salt))
 
         def challenge(self, password):
-            challenge_hash = hashfunc(password.encode(), self._salt)
+            challenge_hash = passhashfunc(password.encode(), self._salt)
             # Always comparing bytes hashes here.
-            return challenge_hash == self._passhash
+            return hmac.compare_digest(challenge_hash, self._passhash or b'')
+
+        # Offloaded hashing. Model attributes are read and written on
+        #   the calling thread; only the hash runs in the executor.
+        async def set_password_async(self, value, executor=None):
+            loop = asyncio.get_running_loop()
+            passhash = await loop.run_in_executor(get_executor(executor),
+                                    passhashfunc, value.encode(), self._salt)
+            self.__passhash = encode(passhash)
+
+        async def challenge_async(self, password, executor=None):
+            loop = asyncio.get_running_loop()
+            passhash = self._passhash
+            challenge_hash = await loop.run_in_executor(
+                                    get_executor(executor), passhashfunc,
+                                    password.encode(), self._salt)
+            return hmac.compare_digest(challenge_hash, passhash or b'')
+
+        @classmethod
+        def set_password_many(cls, pairs, executor=None):
+            """Set passwords for (user, password) `pairs`.
+            """
+            pairs = list(pairs)
+            users, passwords = zip(*pairs) if pairs else ((), ())
+            salts = [user._salt for user in users]
+            passhashes = get_executor(executor).map(passhashfunc,
+                            [password.encode() for password in passwords],
+                            salts)
+            for user, passhash in zip(users, passhashes):
+                user.__passhash = encode(passhash)
+
+        @classmethod
+        def challenge_many(cls, pairs, executor=None):
+            """Challenge (user, password) `pairs`. Returns a list of
+            results in the order of `pairs`.
+            """
+            pairs = list(pairs)
+            users, passwords = zip(*pairs) if pairs else ((), ())
+            salts = [user._salt for user in users]
+            challenge_hashes = get_executor(executor).map(passhashfunc,
+                            [password.encode() for password in passwords],
+                            salts)
+            return [hmac.compare_digest(challenge_hash, user._passhash or b'')
+                        for user, challenge_hash in zip(users,
+                                                        challenge_hashes)]
+
+        @classmethod
+        def get_by_name(cls, session, name):
+            """Return the user named `name` or None. Known names resolve
+            by primary key (usually from the identity map) and unknown
+            names are remembered for `unknown_name_ttl` seconds, so
+            repeated misses do not reach the database.
+            """
+            key = (cls, encode(hashfunc(name.encode())))
+            ident = known_names.get(key)
+            if ident is not None:
+                user = session.get(cls, ident)
+                # The user may have been renamed by another process.
+                if user is not None and user.__namehash == key[1]:
+                    return user
+                known_names.discard(key)
+            elif unknown_names.get(key):
+                return None
+
+            stmt = name_statements.get(cls)
+            if stmt is None:
+                stmt = name_statements[cls] = sqlalchemy.select(cls).where(
+                            cls.__namehash == sqlalchemy.bindparam('namehash'))
+            user = session.execute(stmt, {'namehash': key[1]}).scalar()
+            if user is None:
+                unknown_names.set(key, True)
+            else:
+                known_names.set(key, sqlalchemy.inspect(user).identity)
+            return user
+
+        @classmethod
+        def provision(cls, session, pairs, executor=None, chunk_size=1000,
+                      progress=None):
+            """Insert users from (name, password) `pairs` without
+            creating instances. Salts come from one entropy read, name
+            and password hashes are computed per chunk in the executor
+            and chunks are inserted with executemany as they complete.
+            Returns the number of users inserted.
+
+            `executor` - Defaults to the mixin's `executor` if given,
+                         otherwise `apothecary.util.process_executor()`
+                         so digests of short names and passwords run
+                         in parallel. The hash callables must be
+                         picklable unless a thread pool is passed.
+            `progress` - Called as `progress(done, total)` per chunk.
+            """
+            pairs = list(pairs)
+            total = len(pairs)
+            if not pairs:
+                return 0
+            salts = apothecary.util.random.read(salt_size * total)
+            chunks, batches = [], []
+            for start in range(0, total, chunk_size):
+                chunk = pairs[start:start + chunk_size]
+                for name, password in chunk:
+                    assert isinstance(name, _basestring), "`name` must be a string."
+                    assert name, "`name` cannot be empty."
+                chunks.append(chunk)
+                batches.append(([name.encode() for name, password in chunk],
+                                [password.encode()
+                                    for name, password in chunk],
+                                [salts[i * salt_size:(i + 1) * salt_size]
+                                    for i in range(start,
+                                                   start + len(chunk))]))
+
+            mapper = sqlalchemy.inspect(cls)
+            table = mapper.local_table
+            stmt = sqlalchemy.insert(table)
+            names = session.info.setdefault(('user_names', UserMix), set())
+            executor = (executor or mix_executor or
+                        apothecary.util.process_executor())
+            hashed = executor.map(_provision_hashes,
+                            [hashfunc] * len(batches),
+                            [passhashfunc] * len(batches),
+                            *zip(*batches))
+            done = 0
+            for chunk, batch, hashes in zip(chunks, batches, hashed):
+                rows = [{name_col: name,
+                         namehash_col: encode(namehash),
+                         passhash_col: encode(passhash),
+                         salt_col: encode(salt)}
+                        for (name, password), namehash, passhash, salt in
+                            zip(chunk, hashes[0], hashes[1], batch[2])]
+                apothecary.modelmix._fill_bulk_defaults(table, rows)
+                session.execute(stmt, rows, bind_arguments={'mapper': mapper})
+                names.update((cls, row[namehash_col]) for row in rows)
+                done += len(rows)
+                if progress is not None:
+                    progress(done, total)
+            return done
+
+    # Forget names of users created, renamed or deleted once committed.
+    def after_flush(session, flush_context):
+        keys = session.info.setdefault(('user_names', UserMix), set())
+        for obj in (list(session.new) + list(session.dirty) +
+                    list(session.deleted)):
+            if isinstance(obj, UserMix):
+                history = sqlalchemy.orm.attributes.get_history(obj,
+                        '_UserMix__namehash',
+                        passive=sqlalchemy.orm.attributes.PASSIVE_NO_INITIALIZE)
+                namehashes = list(history.added) + list(history.deleted)
+                if obj in session.deleted:
+                    namehashes.extend(history.unchanged)
+                for namehash in namehashes:
+                    keys.add((obj.__class__, namehash))
+
+    def after_commit(session):
+        for key in session.info.pop(('user_names', UserMix), ()):
+            known_names.discard(key)
+            unknown_names.discard(key)
+
+    def after_rollback(session):
+        session.info.pop(('user_names', UserMix), None)
+
+    sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_flush',
+                            after_flush)
+    sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_commit',
+                            after_commit)
+    sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_rollback',
+                            after_rollback)
 
     setattr(UserMix, name_attr, apothecary.util.synonym('_name'))
     setattr(UserMix, namehash_attr, apothecary.util.synonym('_namehash'))
@@ -137,7 +357,7 @@ def group_mix(name_attr="name", name_col=None, name_size=32,
 
         __level = sqlalchemy.Column(level_col,
                           sqlalchemy.types.Integer(),
-                          nullable=False, default=-1)
+                          nullable=False, default=-1, index=True)
 
         @property
         def _name(self):
@@ -148,7 +368,7 @@ def group_mix(name_attr="name", name_col=None, name_size=32,
             assert isinstance(value, _basestring), "`name` must be a string."
             self.__name = value
 
-        @property
+        @sqlalchemy.ext.hybrid.hybrid_property
         def _level(self):
             return self.__level
 
@@ -157,35 +377,199 @@ def group_mix(name_attr="name", name_col=None, name_size=32,
             assert isinstance(value, int), '`level` must be an integer.'
             self.__level = value
 
-        # Comparators
+        @_level.expression
+        def _level(cls):
+            # Comparisons run in SQL on the indexed column.
+            #   (eg. `query.filter(Group.level >= 100)`)
+            return cls.__level
+
+        # Ordering by level. Equality and hashing stay identity based
+        #   so groups behave in sets and the identity map.
         def __lt__(self, other):
             return self._level < other._level
 
         def __gt__(self, other):
             return self._level > other._level
 
-        def __eq__(self, other):
-            return self._level == other._level
-
         def __le__(self, other):
             return self._level <= other._level
 
         def __ge__(self, other):
             return self._level >= other._level
 
-        def __ne__(self, other):
-            return self._level != other._level
-
     setattr(GroupMix, name_attr, apothecary.util.synonym("_name"))
     setattr(GroupMix, level_attr, apothecary.util.synonym("_level"))
 
     return GroupMix
 
 
-def user_group_mix(user_cls, group_cls):
+def _colnames(cls, colname):
+    """Local column names referencing the primary key of `cls`. A
+    single column key uses `colname`, composite keys get one
+    `[colname]_[key]` column each. A sequence of names is kept as is.
+    """
+    pk_cols = list(cls.__table__.primary_key.columns)
+    if not isinstance(colname, _basestring):
+        assert len(colname) == len(pk_cols), "One column name is required per primary key column."
+        return tuple(colname)
+    if len(pk_cols) == 1:
+        return (colname,)
+    return tuple('_'.join([colname, col.key]) for col in pk_cols)
+
+
+def _association_mix(left_cls, right_cls, left_colname, right_colname):
+    """Create the columns and foreign keys of a left<->right
+    association table. Single column keys get a column `ForeignKey`,
+    composite keys a `ForeignKeyConstraint` added to the table when the
+    model is mapped, so models may still declare `__table_args__`.
+    """
+    left_pk_cols = list(left_cls.__table__.primary_key.columns)
+    right_pk_cols = list(right_cls.__table__.primary_key.columns)
+    left_colnames = _colnames(left_cls, left_colname)
+    right_colnames = _colnames(right_cls, right_colname)
+
+    class AssociationMix(object):
+        """Association Model Mixin.
+        """
+        __left_id_cols__ = left_colnames
+        __right_id_cols__ = right_colnames
+
+    def col(name, parent_col, single):
+        fk = (sqlalchemy.ForeignKey(parent_col),) if single else ()
+        return sqlalchemy.ext.declarative.declared_attr(lambda cls:
+                    sqlalchemy.Column(name, parent_col.type, *fk,
+                                      nullable=False, index=True))
+
+    composite = []
+    for colnames, pk_cols in ((left_colnames, left_pk_cols),
+                              (right_colnames, right_pk_cols)):
+        for name, parent_col in zip(colnames, pk_cols):
+            setattr(AssociationMix, name,
+                    col(name, parent_col, len(pk_cols) == 1))
+        if len(pk_cols) > 1:
+            composite.append((colnames, pk_cols))
+
+    if composite:
+        @sqlalchemy.event.listens_for(AssociationMix, 'instrument_class',
+                                      propagate=True)
+        def add_constraints(mapper, cls):
+            for colnames, pk_cols in composite:
+                mapper.local_table.append_constraint(
+                    sqlalchemy.ForeignKeyConstraint(colnames, pk_cols))
+
+    return AssociationMix
+
+
+def _relationship(association_cls, parent_cls, target_cls, attr, lazy, kwa):
+    kwa['secondary'] = association_cls.__table__
+    if lazy is not None:
+        kwa.setdefault('lazy', lazy)
+    setattr(parent_cls, attr, sqlalchemy.orm.relationship(target_cls, **kwa))
+
+
+def user_group_mix(user_cls, group_cls,
+                   user_id_colname="user_id",
+                   group_id_colname="group_id",
+                   groups_attr="groups",
+                   lazy="selectin",
+                   level_cache_size=10000,
+                   level_cache_ttl=300):
     """Create a User<->Group Association. (Many-to-many).
+
+    `user_id_colname`, `group_id_colname` - Column name, or one name per
+        primary key column.
+    `lazy` - Loader strategy of the user relationship. (eg. "selectin",
+             "joined" or "raise" to catch accidental lazy loads)
+    `level_cache_size` - Users kept by the `max_level` cache.
+    `level_cache_ttl` - Seconds a `max_level` is kept, bounding how long
+        changes committed by other processes go unseen.
     """
-    pass
+    AssociationMix = _association_mix(user_cls, group_cls,
+                                      user_id_colname, group_id_colname)
+    level_cache = apothecary.util.Cache(maxsize=level_cache_size,
+                                        ttl=level_cache_ttl)
+
+    class UserGroup(AssociationMix):
+        """User<->Group Association.
+        """
+        __user_cls__ = user_cls
+        __group_cls__ = group_cls
+        __user_id_cols__ = AssociationMix.__left_id_cols__
+        __group_id_cols__ = AssociationMix.__right_id_cols__
+        __groups_attr__ = groups_attr
+
+        @classmethod
+        def init_user_relationship(cls, **kwa):
+            """Enable the relationship on the User model.
+            """
+            _relationship(cls, user_cls, group_cls, groups_attr, lazy, kwa)
+
+        @classmethod
+        def max_level(cls, session, user):
+            """Return the highest group level of `user` (or its primary
+            key tuple), None without groups. Cached per process for
+            `level_cache_ttl` seconds or until a commit changes the
+            user's groups, any group or this association.
+            """
+            if isinstance(user, user_cls):
+                user = sqlalchemy.inspect(user).identity
+            level = level_cache.get(user, level_cache)
+            if level is level_cache:
+                group_table = group_cls.__table__
+                stmt = (sqlalchemy.select(sqlalchemy.func.max(
+                                    group_cls._level))
+                            .select_from(cls.__table__.join(group_table,
+                                sqlalchemy.and_(*(
+                                    cls.__table__.c[col] == group_col
+                                        for col, group_col in zip(
+                                            cls.__group_id_cols__,
+                                            group_table.primary_key)))))
+                            .where(*(cls.__table__.c[col] == value
+                                        for col, value in zip(
+                                            cls.__user_id_cols__, user))))
+                level = session.execute(stmt).scalar()
+                level_cache.set(user, level)
+            return level
+
+    # Group level changes reach every member.
+    for changed_cls in (UserGroup, group_cls):
+        apothecary.util.on_commit_change(changed_cls, level_cache.clear)
+
+    # Relationship changes flush as user changes; forget only the users
+    #   whose groups changed or that were deleted.
+    def after_flush(session, flush_context):
+        keys = session.info.setdefault(('user_levels', UserGroup), set())
+        for obj in list(session.dirty) + list(session.deleted):
+            if not isinstance(obj, user_cls):
+                continue
+            mapper = sqlalchemy.inspect(obj).mapper
+            if obj not in session.deleted:
+                if groups_attr not in mapper.relationships:
+                    continue
+                history = sqlalchemy.orm.attributes.get_history(obj,
+                        groups_attr,
+                        passive=sqlalchemy.orm.attributes.PASSIVE_NO_INITIALIZE)
+                if not history.has_changes():
+                    continue
+            keys.add(tuple(mapper.primary_key_from_instance(obj)))
+
+    def after_commit(session):
+        for key in session.info.pop(('user_levels', UserGroup), ()):
+            level_cache.discard(key)
+
+    def after_rollback(session):
+        # Levels read through this session may include the rolled back
+        #   changes.
+        after_commit(session)
+
+    sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_flush',
+                            after_flush)
+    sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_commit',
+                            after_commit)
+    sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_rollback',
+                            after_rollback)
+
+    return UserGroup
 
 
 def permission_mix(name_attr="name", name_col=None, name_size=32):
@@ -210,6 +594,7 @@ def permission_mix(name_attr="name", name_col=None, name_size=32):
             self.__name = value
 
     setattr(Permission, name_attr, apothecary.util.synonym('_name'))
+    Permission.__name_col__ = name_col
 
     return Permission
 
@@ -218,43 +603,328 @@ def group_permission_mix(group_cls, permission_cls,
                          group_id_colname="group_id",
                          permission_id_colname="permission_id",
                          permissions_attr="permissions",
-                         init_group_relationship=False):
+                         init_group_relationship=False,
+                         lazy=None):
     """Create a Group<->Permission Association. (Many-to-many).
-    """
-    # This can be abstracted further in to a "general" association func/class.
-    group_pri_key_columns = group_cls.__table__.primary_key.columns.items()
-    perm_pri_key_columns = permission_cls.__table__.primary_key.columns.items()
 
-    # Temporary to disallow models with multiple pri-key columns.
-    assert len(group_pri_key_columns) == 1, "group_permission_mix has no support for multiple primary key columns yet."
-    assert len(perm_pri_key_columns) == 1, "group_permission_mix has no support for multiple primary key columns yet."
-    parent_group_id_col = group_pri_key_columns[0][1]
-    parent_permission_id_col =  perm_pri_key_columns[0][1]
+    `group_id_colname`, `permission_id_colname` - Column name, or one
+        name per primary key column.
+    `init_group_relationship` - Unused; kept for compatibility. Call
+        `init_group_relationship()` on the model.
+    `lazy` - Loader strategy of the group relationship.
+    """
+    AssociationMix = _association_mix(group_cls, permission_cls,
+                                      group_id_colname, permission_id_colname)
 
-    class GroupPermission(object):
+    class GroupPermission(AssociationMix):
         """Group<->Permission Association.
         """
-        __group_id = sqlalchemy.ext.declarative.declared_attr(lambda cls:
-                        sqlalchemy.Column(group_id_colname,
-                            parent_group_id_col.type,
-                            sqlalchemy.ForeignKey(parent_group_id_col)))
-        __permission_id = sqlalchemy.ext.declarative.declared_attr(lambda cls:
-                        sqlalchemy.Column(permission_id_colname,
-                            parent_permission_id_col.type,
-                            sqlalchemy.ForeignKey(parent_permission_id_col)))
+        __group_cls__ = group_cls
+        __permission_cls__ = permission_cls
+        __group_id_cols__ = AssociationMix.__left_id_cols__
+        __permission_id_cols__ = AssociationMix.__right_id_cols__
+        __permissions_attr__ = permissions_attr
 
         @classmethod
         def init_group_relationship(cls, **kwa):
             """Enable the relationship on the Group model.
             """
-            # This seems the most convenient place to put this.
-
-            kwa['secondary'] = cls.__table__
-            setattr(group_cls, permissions_attr,
-                    sqlalchemy.orm.relationship(permission_cls, **kwa))
+            _relationship(cls, group_cls, permission_cls, permissions_attr,
+                          lazy, kwa)
 
     return GroupPermission
 
 
-def user_permission_mix(user_cls, permission_cls):
-    pass
\ No newline at end of file
+def user_permission_mix(user_cls, permission_cls,
+                        user_id_colname="user_id",
+                        permission_id_colname="permission_id",
+                        permissions_attr="permissions",
+                        lazy="selectin"):
+    """Create a User<->Permission Association for permissions granted
+    directly to users. (Many-to-many).
+
+    `lazy` - Loader strategy of the user relationship.
+    """
+    AssociationMix = _association_mix(user_cls, permission_cls,
+                                      user_id_colname, permission_id_colname)
+
+    class UserPermission(AssociationMix):
+        """User<->Permission Association.
+        """
+        __user_cls__ = user_cls
+        __permission_cls__ = permission_cls
+        __user_id_cols__ = AssociationMix.__left_id_cols__
+        __permission_id_cols__ = AssociationMix.__right_id_cols__
+        __permissions_attr__ = permissions_attr
+
+        @classmethod
+        def init_user_relationship(cls, **kwa):
+            """Enable the relationship on the User model.
+            """
+            _relationship(cls, user_cls, permission_cls, permissions_attr,
+                          lazy, kwa)
+
+    return UserPermission
+
+
+def load_effective_permissions(session, users, user_group_cls,
+                               group_permission_cls,
+                               user_permission_cls=None):
+    """Resolve the permission names of each of `users` through their
+    groups and, if given, their direct permissions. Runs one query per
+    association (chunked to the dialect's parameter limit) however
+    many users there are. Returns {user: set(names)}.
+    """
+    users = list(users)
+    result = dict((user, set()) for user in users)
+    if not users:
+        return result
+    user_cls = user_group_cls.__user_cls__
+    permission_cls = group_permission_cls.__permission_cls__
+    dialect = session.get_bind(mapper=sqlalchemy.inspect(user_cls)).dialect
+    by_key = {}
+    for user in users:
+        by_key.setdefault(sqlalchemy.inspect(user).identity, []).append(user)
+
+    def resolve(association_cls, joins):
+        user_cols = [getattr(association_cls, col)
+                        for col in association_cls.__user_id_cols__]
+        name = permission_cls.__table__.c[permission_cls.__name_col__]
+        size = max(1, apothecary.query.param_limit(dialect) // len(user_cols))
+        for chunk in apothecary.query.chunked(list(by_key), size):
+            stmt = sqlalchemy.select(*user_cols + [name])
+            for target, left_cols, right_cols in joins:
+                stmt = stmt.join(target, sqlalchemy.and_(*(left == right
+                                    for left, right in zip(left_cols,
+                                                           right_cols))))
+            stmt = stmt.where(apothecary.query.many_criterion(association_cls,
+                        association_cls.__user_id_cols__, chunk, dialect))
+            for row in session.execute(stmt):
+                for user in by_key[tuple(row[:-1])]:
+                    result[user].add(row[-1])
+
+    def columns(cls, names):
+        return [getattr(cls, col) for col in names]
+
+    permission_pk = list(sqlalchemy.inspect(permission_cls).primary_key)
+    resolve(user_group_cls, [
+        (group_permission_cls,
+         columns(user_group_cls, user_group_cls.__group_id_cols__),
+         columns(group_permission_cls,
+                 group_permission_cls.__group_id_cols__)),
+        (permission_cls,
+         columns(group_permission_cls,
+                 group_permission_cls.__permission_id_cols__),
+         permission_pk)])
+    if user_permission_cls is not None:
+        resolve(user_permission_cls, [
+            (permission_cls,
+             columns(user_permission_cls,
+                     user_permission_cls.__permission_id_cols__),
+             permission_pk)])
+    return result
+
+
+# Live `PermissionIndex`es. The Session listeners are registered once and
+#   dispatch to these, so a discarded index stops receiving events.
+_permission_indexes = weakref.WeakSet()
+_permission_indexes_lock = threading.Lock()
+_permission_indexes_listening = False
+
+
+def _permission_index_dispatch(method):
+    def dispatch(session, *args):
+        for index in list(_permission_indexes):
+            getattr(index, method)(session, *args)
+    return dispatch
+
+
+def _register_permission_index(index):
+    global _permission_indexes_listening
+    with _permission_indexes_lock:
+        if not _permission_indexes_listening:
+            for event, method in (('after_flush', '_after_flush'),
+                                  ('after_commit', '_after_commit'),
+                                  ('after_rollback', '_after_rollback')):
+                sqlalchemy.event.listen(sqlalchemy.orm.Session, event,
+                                        _permission_index_dispatch(method))
+            _permission_indexes_listening = True
+        _permission_indexes.add(index)
+
+
+class PermissionIndex(object):
+    """In memory group -> permission index of a `group_permission_mix`
+    association. Permission names are interned to bit positions and
+    each group holds an integer mask, so checks are a dict lookup and a
+    bit test.
+
+    `load` reads every association with one join query. Afterwards
+    association rows added or removed by a flush (as instances or
+    through the group relationship) are applied when the session
+    commits. Changes to permissions themselves mark the index stale and
+    it is reloaded on the next check that has a session. An index
+    follows sessions until it is closed or garbage collected.
+
+    `groups_attr` - Attribute of users holding their groups.
+    """
+    def __init__(self, association_cls, groups_attr="groups"):
+        self.association_cls = association_cls
+        self.group_cls = association_cls.__group_cls__
+        self.permission_cls = association_cls.__permission_cls__
+        self.groups_attr = groups_attr
+        self.stale = True
+        # ({permission name: bit}, {permission pk: bit}, {group pk: mask}),
+        #   replaced as a whole by `load` so readers never see it empty.
+        self._index = ({}, {}, {})
+        self._lock = threading.RLock()
+        self._info_key = ('permission_index', id(self))
+        _register_permission_index(self)
+
+    def close(self):
+        """Stop following session changes."""
+        _permission_indexes.discard(self)
+
+    @staticmethod
+    def _bit(bits, name):
+        bit = bits.get(name)
+        if bit is None:
+            bit = bits[name] = len(bits)
+        return bit
+
+    def load(self, session):
+        """(Re)build the index with one query."""
+        table = self.association_cls.__table__
+        permission_table = self.permission_cls.__table__
+        group_cols = [table.c[col]
+                        for col in self.association_cls.__group_id_cols__]
+        permission_cols = [table.c[col] for col in
+                                self.association_cls.__permission_id_cols__]
+        permission_pk = list(permission_table.primary_key)
+        name = permission_table.c[self.permission_cls.__name_col__]
+
+        stmt = (sqlalchemy.select(*group_cols + permission_pk + [name])
+                    .select_from(table.join(permission_table,
+                        sqlalchemy.and_(*(left == right for left, right in
+                                          zip(permission_cols,
+                                              permission_pk))))))
+        n_group, n_permission = len(group_cols), len(permission_pk)
+        with self._lock:
+            bits, permissions, masks = {}, {}, {}
+            for row in session.execute(stmt):
+                group = tuple(row[:n_group])
+                permission = tuple(row[n_group:n_group + n_permission])
+                bit = permissions[permission] = self._bit(bits, row[-1])
+                masks[group] = masks.get(group, 0) | 1 << bit
+            self._index = (bits, permissions, masks)
+            self.stale = False
+        return self
+
+    def mask(self, group):
+        """Return the permission mask of a group (or its pk tuple)."""
+        return self._mask(self._index[2], group)
+
+    def _mask(self, masks, group):
+        if isinstance(group, self.group_cls):
+            group = sqlalchemy.inspect(group).identity
+        return masks.get(group, 0)
+
+    def has_permission(self, group_or_user, name, session=None):
+        """Return True if the group, or any group of the user, has the
+        permission `name`.
+        """
+        if self.stale:
+            session = session or sqlalchemy.orm.object_session(group_or_user)
+            if session is not None:
+                self.load(session)
+        bits, permissions, masks = self._index
+        bit = bits.get(name)
+        if bit is None:
+            return False
+        if isinstance(group_or_user, self.group_cls):
+            groups = [group_or_user]
+        else:
+            groups = getattr(group_or_user, self.groups_attr)
+        mask = 0
+        for group in groups:
+            mask |= self._mask(masks, group)
+        return bool(mask >> bit & 1)
+
+    # Incremental refresh. Changes are recorded per session as
+    #   ("add"|"remove", group pk, permission pk, name or None),
+    #   ("drop", group pk) or ("stale",) and applied on commit.
+    def _after_flush(self, session, flush_context):
+        changes = session.info.setdefault(self._info_key, [])
+        assoc = self.association_cls
+        for obj in session.new:
+            if isinstance(obj, assoc):
+                changes.append(("add",) + self._association_key(obj))
+        for obj in session.deleted:
+            if isinstance(obj, assoc):
+                changes.append(("remove",) + self._association_key(obj))
+            elif isinstance(obj, self.group_cls):
+                changes.append(("drop", self._identity(obj)))
+        for obj in list(session.dirty) + list(session.deleted):
+            if isinstance(obj, self.permission_cls):
+                changes.append(("stale",))
+        for group in list(session.new) + list(session.dirty):
+            if isinstance(group, self.group_cls):
+                key = self._identity(group)
+                history = sqlalchemy.orm.attributes.get_history(group,
+                        assoc.__permissions_attr__,
+                        passive=sqlalchemy.orm.attributes.PASSIVE_NO_INITIALIZE)
+                for kind, permissions in (("add", history.added),
+                                          ("remove", history.deleted)):
+                    for permission in permissions:
+                        changes.append((kind, key,
+                                        self._identity(permission),
+                                        permission._name))
+
+    @staticmethod
+    def _identity(obj):
+        # Objects inserted by this flush have no `identity` until it
+        #   completes; read their primary key values instead.
+        state = sqlalchemy.inspect(obj)
+        return tuple(state.mapper.primary_key_from_instance(obj))
+
+    def _association_key(self, obj):
+        state = sqlalchemy.inspect(obj)
+        columns = state.mapper.local_table.c
+        def values(cols):
+            return tuple(state.attrs[state.mapper.get_property_by_column(
+                            columns[col]).key].value for col in cols)
+        return (values(self.association_cls.__group_id_cols__),
+                values(self.association_cls.__permission_id_cols__), None)
+
+    def _after_commit(self, session):
+        changes = session.info.pop(self._info_key, None)
+        if not changes or self.stale:
+            return
+        with self._lock:
+            bits, permissions, masks = self._index
+            for change in changes:
+                if change[0] == "stale":
+                    self.stale = True
+                    return
+                elif change[0] == "drop":
+                    masks.pop(change[1], None)
+                    continue
+                kind, group, permission, name = change
+                if None in group or None in permission:
+                    # Unresolved primary key; reload.
+                    self.stale = True
+                    return
+                bit = permissions.get(permission)
+                if bit is None:
+                    if name is None:
+                        # Unknown permission row; reload.
+                        self.stale = True
+                        return
+                    bit = permissions[permission] = self._bit(bits, name)
+                mask = masks.get(group, 0)
+                if kind == "add":
+                    masks[group] = mask | 1 << bit
+                else:
+                    masks[group] = mask & ~(1 << bit)
+
+    def _after_rollback(self, session):
+        session.info.pop(self._info_key, None)
@@ -0,0 +1,120 @@
+"""Ordered List Model Mixins.
+"""
+import sqlalchemy
+import sqlalchemy.orm
+
+import apothecary.modelmix
+
+
+__all__ = ("ordered_mix",)
+
+
+def ordered_mix(sequence_col="position", gap=1024, scope=(), index=True):
+    """Create an Ordered List Model Mixin on top of `sequence_mix`.
+
+    Positions are allocated `gap` apart so moving an item usually only
+    writes that item's row, taking the midpoint of its new neighbours.
+    When neighbours are adjacent the list is rebalanced first with one
+    set-based UPDATE.
+
+    `sequence_col` - Position column. (Indexed unless `index` is False.)
+    `gap` - Distance between allocated positions.
+    `scope` - Attribute names partitioning rows into separate lists.
+        (eg. ("list_id",))
+    """
+    SequenceMix = apothecary.modelmix.sequence_mix(sequence_col, index=index)
+
+    class OrderedMix(SequenceMix):
+        """Ordered List Model Mixin.
+        """
+        @classmethod
+        def _position(cls):
+            return getattr(cls, sequence_col)
+
+        @classmethod
+        def _pk_attrs(cls):
+            mapper = sqlalchemy.inspect(cls)
+            return [getattr(cls, mapper.get_property_by_column(col).key)
+                        for col in mapper.primary_key]
+
+        @classmethod
+        def _scope_criteria(cls, obj):
+            return [getattr(cls, attr) == getattr(obj, attr) for attr in scope]
+
+        @classmethod
+        def _neighbour(cls, session, obj, criterion, func):
+            session.flush()
+            criteria = cls._scope_criteria(obj) + [criterion]
+            if sqlalchemy.inspect(obj).key is not None:
+                criteria.append(sqlalchemy.not_(sqlalchemy.and_(*(
+                        attr == getattr(obj, attr.key)
+                            for attr in cls._pk_attrs()))))
+            return session.execute(sqlalchemy.select(
+                        func(cls._position())).where(*criteria)).scalar()
+
+        @classmethod
+        def append(cls, session, obj):
+            """Place `obj` at the end of its list and add it."""
+            last = cls._neighbour(session, obj, sqlalchemy.true(),
+                                  sqlalchemy.func.max)
+            setattr(obj, sequence_col, (last or 0) + gap)
+            session.add(obj)
+            return obj
+
+        @classmethod
+        def move(cls, session, obj, before=None, after=None):
+            """Move `obj` directly `before` or `after` another item of
+            the same list.
+            """
+            assert (before is None) != (after is None), "`move` requires one of `before` or `after`."
+            for attempt in range(2):
+                if after is not None:
+                    low = getattr(after, sequence_col)
+                    high = cls._neighbour(session, obj,
+                                          cls._position() > low,
+                                          sqlalchemy.func.min)
+                    if high is None:
+                        high = low + 2 * gap
+                else:
+                    high = getattr(before, sequence_col)
+                    low = cls._neighbour(session, obj,
+                                         cls._position() < high,
+                                         sqlalchemy.func.max)
+                    if low is None:
+                        low = high - 2 * gap
+                if high - low > 1:
+                    setattr(obj, sequence_col, (low + high) // 2)
+                    return obj
+                # No room between the neighbours.
+                cls.rebalance(session, obj)
+            raise RuntimeError("Could not find a free position.")
+
+        @classmethod
+        def rebalance(cls, session, obj=None):
+            """Renumber positions `gap` apart, keeping their order, with
+            a single UPDATE. Limited to the list of `obj` if given.
+            """
+            mapper = sqlalchemy.inspect(cls)
+            table = mapper.local_table
+            pk_cols = list(mapper.primary_key)
+            position = mapper.columns[sequence_col]
+            scope_cols = [mapper.columns[attr] for attr in scope]
+
+            renumbered = sqlalchemy.select(*pk_cols).add_columns(
+                (sqlalchemy.func.row_number().over(
+                    partition_by=scope_cols or None,
+                    order_by=[position] + pk_cols) * gap).label('position'))
+            if obj is not None:
+                renumbered = renumbered.where(*(col == getattr(obj, attr)
+                                    for col, attr in zip(scope_cols, scope)))
+            renumbered = renumbered.subquery()
+            session.execute(sqlalchemy.update(table)
+                                .where(*(col == renumbered.c[col.key]
+                                            for col in pk_cols))
+                                .values({position: renumbered.c.position}))
+
+            for instance in list(session.identity_map.values()):
+                if isinstance(instance, cls):
+                    session.expire(instance, [sequence_col])
+
+    return OrderedMix
@@ -1,7 +1,9 @@
 import pprint
 
+import hmac
 import base64
 import inspect
+import binascii
 import logging
 import sqlalchemy
 import sqlalchemy.types
@@ -19,10 +21,17 @@ logger = logging.getLogger(__name__)
 def record_token_mix(attr_name, col_name=None, length=6, onupdate=False,
                      index=True, binary_encode=False,
                      tokenfunc=apothecary.util.token,
-                     hashfunc=apothecary.util.hash,
-                     basefunc=apothecary.util.benc):
+                     hashfunc='token',
+                     basefunc=apothecary.util.benc,
+                     defer=False, defer_group='security'):
     """Random tokens used for ident or other security functionality.
+
+    `hashfunc` - Hash callable or profile name used to whiten tokens.
+    `defer` - Defer loading the token column until accessed.
+    `defer_group` - Defer group of the column. (See
+                    `apothecary.query.undefer_groups`)
     """
+    hashfunc = apothecary.util.hash_profile(hashfunc)
 
     if length < 6:
         log.warning("`record_token_mix` with a length less than 6 is not "
@@ -47,6 +56,14 @@ def record_token_mix(attr_name, col_name=None, length=6, onupdate=False,
     def token():
         return hashfunc(tokenfunc(length))[:length]
 
+    def bulk_tokens(n):
+        # Vectorized default for `ConstructorMix.bulk_create`.
+        if tokenfunc is apothecary.util.token:
+            values = apothecary.util.tokens(n, length)
+        else:
+            values = [tokenfunc(length) for i in range(n)]
+        return [encode(hashfunc(value)[:length]) for value in values]
+
     class RecordTokenMix(object):
         """
         """
@@ -62,22 +79,32 @@ def record_token_mix(attr_name, col_name=None, length=6, onupdate=False,
 
     def col_args(**kwa):
         kwa['default'] = lambda *a: encode(token())
+        kwa['info'] = {'bulk_default': bulk_tokens}
         if onupdate is True:
             kwa['onupdate'] = lambda *a: encode(token())
         kwa['nullable'] = False # not(oncreate or onupdate)
         kwa['index'] = index is True
         return kwa
 
+    if defer is True:
+        column = apothecary.util.deferred
+        col_kwa = {'group': defer_group}
+    else:
+        column = sqlalchemy.Column
+        col_kwa = {}
+
     if binary_encode is True:
         # Set up a string column for binary encoded values.
         setattr(RecordTokenMix, _attr_name,
-                sqlalchemy.Column(_col_name,
-                    sqlalchemy.types.String(_binary_token_size), **col_args()))
+                column(_col_name,
+                    sqlalchemy.types.String(_binary_token_size),
+                    **col_args(**col_kwa)))
     else:
         # Set up a binary column.
         setattr(RecordTokenMix, _attr_name,
-                sqlalchemy.Column(_col_name,
-                    sqlalchemy.types.LargeBinary(length), **col_args()))
+                column(_col_name,
+                    sqlalchemy.types.LargeBinary(length),
+                    **col_args(**col_kwa)))
 
     # Set up a synonym for the user defined attribute name.
     setattr(RecordTokenMix, attr_name,
@@ -97,7 +124,9 @@ def url_token_mix(created_col='token_created', created_token_size=8,
                   updated_token='token_updated', updated_token_size=8,
                   hashfunc=apothecary.util.hash):
     """
+    `hashfunc` - Hash callable or profile name used for securls.
     """
+    hashfunc = apothecary.util.hash_profile(hashfunc)
     CreatedToken = record_token_mix(created_col, length=created_token_size,
                                     index=True)
     UpdatedToken = record_token_mix(updated_token, length=updated_token_size,
@@ -106,20 +135,37 @@ def url_token_mix(created_col='token_created', created_token_size=8,
     class UrlTokenMix(UpdatedToken, CreatedToken):
         """Provides one-time tokens 
         """
+        def _securl_digest(self, *namespace):
+            hashargs = (CreatedToken.get_token(self),
+                        UpdatedToken.get_token(self)) + namespace
+            return hashfunc(*hashargs)
+
         def get_securl(self, *namespace):
             """Returns hash based on the model's `SecMix.immutid`,
             `SecMix.mutid` and any `args` passed to provide a
             namespaceself.
             """
-            hashargs = (CreatedToken.get_token(self),
-                        UpdatedToken.get_token(self)) + namespace
-            digest = hashfunc(*hashargs)
+            digest = self._securl_digest(*namespace)
             return base64.urlsafe_b64encode(digest)#.rstrip('=')
 
         def validate_securl(self, challenge, *namespace):
             """Validates a challenge code"""
             # formerly validate_code
-            return self.get_securl(*namespace) == challenge
+            # Decode the challenge once and compare raw digests in
+            #   constant time.
+            try:
+                if isinstance(challenge, str):
+                    challenge = challenge.encode('ascii')
+                # Strict; reject characters outside the urlsafe alphabet.
+                #   (`altchars` alone would still let "+/" through.)
+                if b'+' in challenge or b'/' in challenge:
+                    return False
+                challenge_digest = base64.b64decode(challenge, altchars=b'-_',
+                                                    validate=True)
+            except (binascii.Error, TypeError, ValueError):
+                return False
+            return hmac.compare_digest(self._securl_digest(*namespace),
+                                       challenge_digest)
 
         securl = property(get_securl)
         securlid = sqlalchemy.ext.declarative.declared_attr(
@@ -1,10 +1,111 @@
 import sqlalchemy
+import sqlalchemy.orm
+import sqlalchemy.sql.elements
+import sqlalchemy.sql.visitors
 import apothecary.singleton
 
 
-def dict_query(Model, session=None, query=None, like=False, any=False):
+# Compiled filter plans keyed by (Model, frozenset(keys), like, any).
+_plan_cache = {}
+
+# Dialects that accept a row-value `(a, b) IN ((1, 2), (3, 4))`.
+tuple_in_dialects = ('postgresql', 'mysql', 'mariadb', 'sqlite', 'oracle')
+
+# Maximum bound parameters per statement. (Conservative)
+param_limits = {'sqlite': 999, 'mssql': 2100, 'oracle': 1000}
+default_param_limit = 10000
+
+
+def param_limit(dialect):
+    """Return the bound parameter limit of a `dialect`.
+    """
+    return param_limits.get(dialect.name, default_param_limit)
+
+
+def chunked(iterable, size):
+    """Yield lists of at most `size` items from `iterable`.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _attr(Model, key):
+    attr = getattr(Model, key, None)
+    if attr is None:
+        raise KeyError("Attribute `%s` does not exist in model `%s`." %
+                            (key, Model.__name__))
+    return attr
+
+
+def _criterion(Model, values, like=False, any=False):
+    """Build the filter criterion for a dict of `values`.
+    """
+    def build_filters():
+        for key, val in values.items():
+            attr = _attr(Model, key)
+            if like is True:
+                yield attr.like(val)
+            else:
+                yield attr == val
+    if any is True: # Process `any` as "or" and default as "and"
+        return sqlalchemy.or_(*build_filters())
+    else:
+        return sqlalchemy.and_(*build_filters())
+
+
+def _bind_name(key):
+    return '_'.join(['dq', key])
+
+
+def filter_plan(Model, keys, like=False, any=False):
+    """Return the cached filter criterion for this query shape.
+    Values are left as bound parameters named by `_bind_name`. Use
+    `bind_plan` to fill them in; the criterion is only a template.
+    """
+    shape = (Model, frozenset(keys), like, any)
+    plan = _plan_cache.get(shape)
+    if plan is None:
+        params = dict((key, sqlalchemy.bindparam(_bind_name(key)))
+                        for key in shape[1])
+        plan = _plan_cache[shape] = _criterion(Model, params, like=like,
+                                               any=any)
+    return plan
+
+
+def bind_plan(plan, values):
+    """Return a copy of `plan` with its `_bind_name` parameters replaced
+    by unique bound `values`, so several bound plans can share one
+    statement. The SQL compilation is still cached per shape.
+    """
+    names = dict((_bind_name(key), val) for key, val in values.items())
+    def replace(element):
+        if (isinstance(element, sqlalchemy.sql.elements.BindParameter) and
+                element.key in names):
+            return sqlalchemy.bindparam(element.key, names[element.key],
+                                        type_=element.type, unique=True)
+    return sqlalchemy.sql.visitors.replacement_traverse(plan, {}, replace)
+
+
+def undefer_groups(*groups):
+    """Return loader options undeferring each of the named defer
+    `groups`. (eg. `query.options(*undefer_groups("security"))`)
+    """
+    return [sqlalchemy.orm.undefer_group(group) for group in groups]
+
+
+def dict_query(Model, session=None, query=None, like=False, any=False,
+               cache=False):
     """Return an object for querying that accepts keyword arguments
     to directly query.
+
+    `cache` - Reuse a compiled filter plan per set of keys. Repeat calls
+              only bind the values.
     """
 
     def _dict_query(*args, **kwa):
@@ -15,19 +116,149 @@ def dict_query(Model, session=None, query=None, like=False, any=False):
         else:
             Query = query # Get the query object from the session.
 
-        def build_filters():
-            for key, val in kwa.items():
-                attr = getattr(Model, key, None)
-                if attr is not None:
-                    if like is True:
-                        yield attr.like(val)
-                    else:
-                        yield attr == val
-                else:
-                    raise KeyError("Attribute `%s` does not exist in model `%s`." % 
-                                        (key, Model.__name__))
-        if any is True: # Process `any` as "or" and default as "and"
-            return Query.filter(sqlalchemy.or_(*build_filers()))
+        if not kwa:
+            return Query
+        elif cache is True:
+            plan = filter_plan(Model, kwa, like=like, any=any)
+            return Query.filter(bind_plan(plan, kwa))
         else:
-            return Query.filter(sqlalchemy.and_(*build_filters()))
+            return Query.filter(_criterion(Model, kwa, like=like, any=any))
     return _dict_query
+
+
+def many_criterion(Model, keys, rows, dialect):
+    """Build one criterion matching any of `rows` (value tuples ordered
+    as `keys`).
+    """
+    attrs = [_attr(Model, key) for key in keys]
+    if len(attrs) == 1:
+        return attrs[0].in_([row[0] for row in rows])
+    elif dialect.name in tuple_in_dialects:
+        return sqlalchemy.tuple_(*attrs).in_(rows)
+    else:
+        return sqlalchemy.or_(*(sqlalchemy.and_(*(attr == val
+                                    for attr, val in zip(attrs, row)))
+                                for row in rows))
+
+
+def _coerce(attr, value):
+    """Convert `value` to the Python type `attr`'s column returns, so it
+    compares equal to the loaded value. (eg. "1" -> 1 for an Integer)
+    Values that don't convert are returned unchanged.
+    """
+    try:
+        python_type = attr.type.python_type
+    except (AttributeError, NotImplementedError):
+        return value
+    if (value is None or python_type is bool or
+            isinstance(value, python_type)):
+        return value
+    try:
+        return python_type(value)
+    except (TypeError, ValueError, ArithmeticError):
+        return value
+
+
+def dict_query_many(Model, session, kwa_list, chunk_size=None):
+    """Resolve many keyword dicts with one SELECT per chunk rather than
+    one per dict. Returns a list of result lists in the order of
+    `kwa_list`.
+
+    Dicts are grouped by their set of keys. Each group is matched with
+    a tuple `IN` where the dialect supports it, otherwise an OR of ANDs.
+    Only equality is supported and values must be hashable. Values are
+    converted to their column's Python type first, since rows are
+    matched back to the dicts by comparing them in Python.
+
+    `chunk_size` - Dicts per statement. Defaults to what fits in the
+                   dialect's bound parameter limit.
+    """
+    kwa_list = list(kwa_list)
+    results = [[] for kwa in kwa_list]
+    dialect = session.get_bind(mapper=sqlalchemy.inspect(Model)).dialect
+
+    # Group input positions by key shape, then by value tuple.
+    shapes = {}
+    for i, kwa in enumerate(kwa_list):
+        keys = tuple(sorted(kwa))
+        row = tuple(_coerce(_attr(Model, key), kwa[key]) for key in keys)
+        shapes.setdefault(keys, {}).setdefault(row, []).append(i)
+
+    for keys, rows in shapes.items():
+        if not keys:
+            everything = session.query(Model).all()
+            for i in rows[()]:
+                results[i] = list(everything)
+            continue
+        size = chunk_size or max(1, param_limit(dialect) // len(keys))
+        for chunk in chunked(rows, size):
+            criterion = many_criterion(Model, keys, chunk, dialect)
+            for obj in session.query(Model).filter(criterion):
+                row = tuple(getattr(obj, key) for key in keys)
+                for i in rows.get(row, ()):
+                    results[i].append(obj)
+    return results
+
+
+def dict_query_iter(Model, session=None, page_size=1000, columns=None,
+                    like=False, any=False):
+    """Return a generator function that streams keyword query results
+    in primary key order, one page at a time.
+
+    Pages are fetched by keyset (`pk > last pk`) rather than OFFSET and
+    each page is read with `yield_per` so only `page_size` rows are held
+    at once. Server side cursors are used where the dialect has them.
+
+    `page_size` - Rows fetched per statement.
+    `columns` - Attribute names to project. Rows are yielded as tuples
+                instead of model instances. Primary key columns that
+                were not requested are appended to each row.
+    """
+    mapper = sqlalchemy.inspect(Model)
+    pk_attrs = [getattr(Model, mapper.get_property_by_column(col).key)
+                    for col in mapper.primary_key]
+    if columns:
+        entities = [_attr(Model, key) for key in columns]
+        pk_index = []
+        for pk_attr in pk_attrs:
+            if pk_attr.key in columns:
+                pk_index.append(list(columns).index(pk_attr.key))
+            else:
+                pk_index.append(len(entities))
+                entities.append(pk_attr)
+        def pk_of(row):
+            return tuple(row[i] for i in pk_index)
+    else:
+        entities = [Model]
+        def pk_of(obj):
+            return tuple(mapper.primary_key_from_instance(obj))
+
+    if len(pk_attrs) == 1:
+        def after(last):
+            return pk_attrs[0] > last[0]
+    else:
+        def after(last):
+            return sqlalchemy.tuple_(*pk_attrs) > sqlalchemy.tuple_(*last)
+
+    def _dict_query_iter(*args, **kwa):
+        assert session or args, "`dict_query_iter` requires a SQLA Session argument."
+        Session = session or args[0]
+        criterion = kwa and _criterion(Model, kwa, like=like, any=any)
+
+        last = None
+        while True:
+            Query = Session.query(*entities)
+            if kwa:
+                Query = Query.filter(criterion)
+            if last is not None:
+                Query = Query.filter(after(last))
+            Query = (Query.order_by(*pk_attrs).limit(page_size)
+                        .yield_per(page_size))
+            count = 0
+            for row in Query:
+                count += 1
+                last = pk_of(row)
+                yield row
+            if count < page_size:
+                break
+    return _dict_query_iter
@@ -0,0 +1,151 @@
+"""Read only, memory mapped snapshots of small key/value tables.
+
+Layout (little endian)::
+
+    header   magic "APLK", version (u8), columns (u8), 2 pad, count (u32)
+    offsets  count + 1 record offsets (u64), relative to the records
+    records  per column a byte length (u32, 0xFFFFFFFF for NULL) then
+             the UTF-8 bytes. The first column is the key.
+
+Records are sorted by key bytes so lookups are a binary search over the
+mapped file. Every process opening the same file shares its pages.
+"""
+import os
+import mmap
+import struct
+import tempfile
+
+
+__all__ = ("write_snapshot", "LookupSnapshot")
+
+magic = b"APLK"
+version = 1
+
+_header = struct.Struct("<4sBBxxI")
+_offset = struct.Struct("<Q")
+_length = struct.Struct("<I")
+_null = 0xFFFFFFFF
+# Snapshots are shared by workers of any user.
+file_mode = 0o644
+
+
+def _encode(value):
+    if value is None:
+        return _length.pack(_null)
+    value = value.encode("utf-8")
+    return _length.pack(len(value)) + value
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def write_snapshot(path, rows, mode=file_mode):
+    """Write `rows` (tuples of str or None, key first) to a snapshot at
+    `path`. The file is replaced atomically.
+
+    `mode` - File permissions, masked by the umask. (`mkstemp` files
+             are only readable by their owner.)
+    """
+    rows = sorted((tuple(row) for row in rows),
+                  key=lambda row: row[0].encode("utf-8"))
+    columns = len(rows[0]) if rows else 1
+    records = [b"".join(_encode(value) for value in row) for row in rows]
+
+    offsets = [0]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_header.pack(magic, version, columns, len(records)))
+            f.write(b"".join(_offset.pack(offset) for offset in offsets))
+            f.writelines(records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode & ~_umask())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class LookupSnapshot(object):
+    """Memory mapped reader of a `write_snapshot` file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, file_version, self.columns, self.count = \
+                _header.unpack_from(self._mmap, 0)
+        if file_magic != magic or file_version != version:
+            self.close()
+            raise ValueError("`%s` is not a lookup snapshot." % path)
+        self._offsets = _header.size
+        self._records = self._offsets + _offset.size * (self.count + 1)
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, i):
+        return self._records + _offset.unpack_from(self._mmap,
+                                        self._offsets + _offset.size * i)[0]
+
+    def _field(self, pos):
+        """Return (bytes or None, next position)."""
+        length = _length.unpack_from(self._mmap, pos)[0]
+        pos += _length.size
+        if length == _null:
+            return None, pos
+        return self._mmap[pos:pos + length], pos + length
+
+    def _row(self, i):
+        pos = self._record(i)
+        row = []
+        for column in range(self.columns):
+            value, pos = self._field(pos)
+            row.append(value if value is None else value.decode("utf-8"))
+        return tuple(row)
+
+    def _find(self, key):
+        key = key.encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            current = self._field(self._record(mid))[0]
+            if current < key:
+                low = mid + 1
+            elif current > key:
+                high = mid
+            else:
+                return mid
+        return None
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def get(self, key, default=None):
+        """Return the row tuple of `key`."""
+        i = self._find(key)
+        return default if i is None else self._row(i)
+
+    def get_many(self, keys, default=None):
+        return [self.get(key, default) for key in keys]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._row(i)
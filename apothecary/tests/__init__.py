@@ -1,5 +1,7 @@
 import unittest
+import contextlib
 import sqlalchemy
+import sqlalchemy.event
 import sqlalchemy.orm
 
 
@@ -25,4 +27,18 @@ class SqlaTestCase(unittest.TestCase):
     def add(self, obj):
         self.__session__.add(obj)
         self.__session__.commit()
-        return obj
\ No newline at end of file
+        return obj
+
+    @contextlib.contextmanager
+    def count_statements(self):
+        """Collect the SQL of each statement executed in the block."""
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqlalchemy.event.listen(self.__engine__, 'before_cursor_execute',
+                                before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            sqlalchemy.event.remove(self.__engine__, 'before_cursor_execute',
+                                    before_cursor_execute)
@@ -1,8 +1,13 @@
+import gc
+import asyncio
+import concurrent.futures
 import unittest
 import sqlalchemy
 import sqlalchemy.types
 import sqlalchemy.ext.declarative
 
+import apothecary.util
+import apothecary.query
 import apothecary.modelmix.auth
 
 from apothecary.tests import SqlaTestCase
@@ -24,6 +29,21 @@ class UserMixEncModel(Base, apothecary.modelmix.auth.user_mix(binary_encode=True
     id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
 
 
+class UserMixKdfModel(Base, apothecary.modelmix.auth.user_mix(
+                                passhashfunc='password')):
+    """
+    """
+    __tablename__ = "test_user_mix_kdf"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+class UserMixDeferModel(Base, apothecary.modelmix.auth.user_mix(defer=True)):
+    """
+    """
+    __tablename__ = "test_user_mix_defer"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
 class GroupMix(Base, apothecary.modelmix.auth.group_mix()):
     __tablename__ = "test_group_mix"
     __id_attr__ = "id"
@@ -56,6 +76,53 @@ class GroupPermissionMix(Base,
 GroupPermissionMix.init_group_relationship()
 
 
+class GroupArgsModel(Base, apothecary.modelmix.auth.group_mix()):
+    __tablename__ = "test_group_args"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+class GroupPermissionArgsMix(Base,
+        apothecary.modelmix.auth.group_permission_mix(GroupArgsModel,
+                PermissionMix, init_group_relationship=False)):
+    __tablename__ = "test_group_permission_args"
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+GroupPermissionArgsMix.init_group_relationship()
+
+
+class UserGroupMix(Base,
+        apothecary.modelmix.auth.user_group_mix(UserMixModel, GroupMix)):
+    __tablename__ = "test_user_group_mix"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+UserGroupMix.init_user_relationship()
+
+
+class UserPermissionMix(Base,
+        apothecary.modelmix.auth.user_permission_mix(UserMixModel,
+                PermissionMix, permissions_attr="direct_permissions")):
+    __tablename__ = "test_user_permission_mix"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+UserPermissionMix.init_user_relationship()
+
+
+class CompositeGroupModel(Base, apothecary.modelmix.auth.group_mix()):
+    __tablename__ = "test_composite_group"
+    realm = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+class UserCompositeGroupMix(Base,
+        apothecary.modelmix.auth.user_group_mix(UserMixEncModel,
+                CompositeGroupModel, lazy="raise")):
+    __tablename__ = "test_user_composite_group_mix"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+UserCompositeGroupMix.init_user_relationship()
+
+
 class TestModelMixAuth(SqlaTestCase):
     __base__ = Base
 
@@ -91,6 +158,58 @@ class TestModelMixAuth(SqlaTestCase):
         self.assertTrue(queried_user.challenge('12345'))
         self.assertFalse(queried_user.challenge('54321'))
 
+    def test_user_mix_passhashfunc(self):
+        user = UserMixKdfModel(name="first")
+        user.password = u"12345"
+        self.add(user)
+
+        queried_user = self.query(UserMixKdfModel).first()
+        self.assertEqual(queried_user.passhash,
+                    apothecary.util.hash_profile('password')(
+                        u"12345".encode(), queried_user._salt))
+        self.assertTrue(queried_user.challenge('12345'))
+        self.assertFalse(queried_user.challenge('54321'))
+
+    def test_user_mix_defer(self):
+        user = UserMixDeferModel(name=u"first")
+        user.password = u"12345"
+        self.add(user)
+        self.__session__.remove()
+
+        user = self.query(UserMixDeferModel).first()
+        loaded = sqlalchemy.inspect(user).dict
+        self.assertEqual(len([key for key in loaded if 'hash' in key]), 0)
+        self.assertTrue(user.challenge('12345'))
+        self.__session__.remove()
+
+        user = (self.query(UserMixDeferModel)
+                    .options(*apothecary.query.undefer_groups('security'))
+                    .first())
+        loaded = sqlalchemy.inspect(user).dict
+        self.assertEqual(len([key for key in loaded if 'hash' in key]), 2)
+
+    def test_user_mix_offloaded(self):
+        users = [UserMixKdfModel(name=u"user%s" % i) for i in range(4)]
+        UserMixKdfModel.set_password_many(
+                    [(user, u"pass%s" % i) for i, user in enumerate(users)])
+        for user in users:
+            self.add(user)
+
+        pairs = [(user, u"pass%s" % i) for i, user in enumerate(users)]
+        pairs.append((users[0], u"wrong"))
+        self.assertEqual(UserMixKdfModel.challenge_many(pairs),
+                         [True, True, True, True, False])
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(users[0].set_password_async(u"new"))
+            self.assertTrue(loop.run_until_complete(
+                                users[0].challenge_async(u"new")))
+            self.assertFalse(loop.run_until_complete(
+                                users[0].challenge_async(u"pass0")))
+        finally:
+            loop.close()
+
     def test_group_mix(self):
         group = GroupMix()
         group.name = u"Peasants"
@@ -137,3 +256,301 @@ class TestModelMixAuth(SqlaTestCase):
         group.permissions.append(permission)
         self.add(group)
 
+    def test_permission_index(self):
+        session = self.__session__
+        read, write = PermissionMix(name="READ"), PermissionMix(name="WRITE")
+        admin, guest = GroupMix(name="admin"), GroupMix(name="guest")
+        admin.permissions.extend([read, write])
+        guest.permissions.append(read)
+        session.add_all([admin, guest])
+        session.commit()
+
+        index = apothecary.modelmix.auth.PermissionIndex(GroupPermissionMix)
+        self.assertTrue(index.has_permission(admin, "WRITE"))
+        self.assertTrue(index.has_permission(guest, "READ"))
+        self.assertFalse(index.has_permission(guest, "WRITE"))
+        self.assertFalse(index.has_permission(guest, "NOPE"))
+        self.assertFalse(index.stale)
+
+        class User(object):
+            groups = [guest, admin]
+        self.assertTrue(index.has_permission(User(), "WRITE"))
+
+        # Checks during a reload see the previous index.
+        during = []
+        def check(orm_execute_state):
+            during.append(index.has_permission(admin, "WRITE"))
+        sqlalchemy.event.listen(session, 'do_orm_execute', check)
+        try:
+            index.load(session)
+        finally:
+            sqlalchemy.event.remove(session, 'do_orm_execute', check)
+        self.assertEqual(during, [True])
+
+        # Incremental updates, applied on commit.
+        guest.permissions.append(write)
+        admin.permissions.remove(read)
+        session.flush()
+        self.assertFalse(index.has_permission(guest, "WRITE"))
+        session.commit()
+        self.assertTrue(index.has_permission(guest, "WRITE"))
+        self.assertFalse(index.has_permission(admin, "READ"))
+
+        delete = PermissionMix(name="DELETE")
+        admin.permissions.append(delete)
+        session.commit()
+        self.assertTrue(index.has_permission(admin, "DELETE"))
+
+        admin.permissions.remove(delete)
+        session.rollback()
+        self.assertTrue(index.has_permission(admin, "DELETE"))
+
+        session.add(GroupPermissionMix(group_id=guest.id,
+                                       permission_id=delete.id))
+        session.commit()
+        self.assertTrue(index.has_permission(guest, "DELETE"))
+        self.assertFalse(index.stale)
+
+        # Renaming a permission reloads.
+        delete.name = "REMOVE"
+        session.commit()
+        self.assertTrue(index.stale)
+        self.assertTrue(index.has_permission(guest, "REMOVE"))
+        self.assertFalse(index.has_permission(guest, "DELETE"))
+
+        # Flushing a group does not load its permissions.
+        session.commit()
+        guest.name
+        with self.count_statements() as statements:
+            guest.name = "visitor"
+            session.flush()
+        self.assertEqual(len(statements), 1)
+        session.commit()
+
+    def test_permission_index_new_rows(self):
+        session = self.__session__
+        base = GroupMix(name="base")
+        session.add(base)
+        session.commit()
+        index = apothecary.modelmix.auth.PermissionIndex(GroupPermissionMix)
+        index.load(session)
+
+        # New group and new permission in one commit.
+        group = GroupMix(name="new")
+        group.permissions.append(PermissionMix(name="A"))
+        session.add(group)
+        session.commit()
+        self.assertTrue(index.has_permission(group, "A"))
+
+        # Successive new permissions get their own bits.
+        base.permissions.append(PermissionMix(name="B"))
+        session.commit()
+        base.permissions.append(PermissionMix(name="C"))
+        session.commit()
+        self.assertFalse(index.has_permission(base, "A"))
+        self.assertTrue(index.has_permission(base, "B"))
+        self.assertTrue(index.has_permission(base, "C"))
+        self.assertFalse(index.has_permission(group, "B"))
+        self.assertFalse(index.stale)
+
+    def test_permission_index_release(self):
+        indexes = apothecary.modelmix.auth._permission_indexes
+        index = apothecary.modelmix.auth.PermissionIndex(GroupPermissionMix)
+        self.assertIn(index, indexes)
+        index.close()
+        self.assertNotIn(index, indexes)
+
+        index = apothecary.modelmix.auth.PermissionIndex(GroupPermissionMix)
+        count = len(indexes)
+        del index
+        gc.collect()
+        self.assertEqual(len(indexes), count - 1)
+
+    def test_user_group_mix(self):
+        session = self.__session__
+        read, write = PermissionMix(name="READ"), PermissionMix(name="WRITE")
+        admin, guest = GroupMix(name="admin"), GroupMix(name="guest")
+        admin.permissions.append(write)
+        guest.permissions.append(read)
+        users = [UserMixModel(name="user%s" % i) for i in range(5)]
+        for user in users:
+            user.groups.append(guest)
+        users[0].groups.append(admin)
+        users[1].direct_permissions.append(write)
+        session.add_all(users)
+        session.commit()
+        session.remove()
+
+        session = self.__session__
+        with self.count_statements() as statements:
+            users = session.query(UserMixModel).order_by(UserMixModel.id).all()
+            self.assertEqual([len(user.groups) for user in users],
+                             [2, 1, 1, 1, 1])
+            self.assertEqual(len(statements), 3) # users, groups, direct perms
+            del statements[:]
+
+            permissions = apothecary.modelmix.auth.load_effective_permissions(
+                                session, users, UserGroupMix,
+                                GroupPermissionMix, UserPermissionMix)
+            self.assertEqual(len(statements), 2)
+        self.assertEqual([permissions[user] for user in users],
+                         [set(["READ", "WRITE"]), set(["READ", "WRITE"]),
+                          set(["READ"]), set(["READ"]), set(["READ"])])
+
+    def test_group_permission_mix_table_args(self):
+        self.assertEqual(len(GroupPermissionArgsMix.__table__.foreign_keys), 2)
+        group = GroupArgsModel(name="group")
+        group.permissions.append(PermissionMix(name="PERM"))
+        self.add(group)
+        self.assertEqual([permission.name for permission in
+                          self.query(GroupArgsModel).one().permissions],
+                         ["PERM"])
+
+    def test_user_group_mix_composite(self):
+        session = self.__session__
+        table = UserCompositeGroupMix.__table__
+        self.assertEqual(UserCompositeGroupMix.__group_id_cols__,
+                         ("group_id_realm", "group_id_id"))
+        self.assertEqual(len([constraint for constraint in
+                              table.foreign_key_constraints
+                              if len(constraint.columns) == 2]), 1)
+
+        user = UserMixEncModel(name="user")
+        user.groups.append(CompositeGroupModel(realm=1, id=1, name="group"))
+        session.add(user)
+        session.commit()
+        session.remove()
+
+        user = self.__session__.query(UserMixEncModel).first()
+        self.assertRaises(sqlalchemy.exc.InvalidRequestError,
+                          lambda: user.groups)
+        user = (self.__session__.query(UserMixEncModel)
+                    .options(sqlalchemy.orm.selectinload(
+                                UserMixEncModel.groups)).first())
+        self.assertEqual([(group.realm, group.id, group.name)
+                            for group in user.groups], [(1, 1, "group")])
+
+    def test_group_mix_level(self):
+        session = self.__session__
+        groups = [GroupMix(name=name, level=level) for name, level in
+                    (("guest", 0), ("member", 10), ("admin", 100))]
+        session.add_all(groups)
+        user = UserMixModel(name="user")
+        user.groups.extend(groups[:2])
+        session.add(user)
+        session.commit()
+
+        self.assertEqual(len(set(groups)), 3)
+        self.assertNotEqual(groups[0], GroupMix(name="other", level=0))
+        self.assertEqual(sorted(groups, reverse=True)[0].name, "admin")
+        self.assertTrue(any(index.columns.keys() == ["level"]
+                            for index in GroupMix.__table__.indexes))
+        self.assertEqual([group.name for group in session.query(GroupMix)
+                            .filter(GroupMix.level >= 10)
+                            .order_by(GroupMix.level)], ["member", "admin"])
+
+        self.assertEqual(UserGroupMix.max_level(session, user), 10)
+        key = (user.id,)
+        with self.count_statements() as statements:
+            self.assertEqual(UserGroupMix.max_level(session, key), 10)
+        self.assertEqual(statements, [])
+
+        user.groups.append(groups[2])
+        session.commit()
+        self.assertEqual(UserGroupMix.max_level(session, user), 100)
+        groups[2].level = 50
+        session.commit()
+        self.assertEqual(UserGroupMix.max_level(session, user), 50)
+        self.assertIsNone(UserGroupMix.max_level(session, (-1,)))
+
+        # Other user changes keep cached levels.
+        other = UserMixModel(name="other")
+        other.groups.append(groups[0])
+        session.add(other)
+        session.commit()
+        self.assertEqual(UserGroupMix.max_level(session, other), 0)
+        key = (user.id,)
+        user.name = "renamed"
+        session.commit()
+        with self.count_statements() as statements:
+            self.assertEqual(UserGroupMix.max_level(session, key), 50)
+        self.assertEqual(statements, [])
+        user.groups.remove(groups[2])
+        session.commit()
+        self.assertEqual(UserGroupMix.max_level(session, user), 10)
+        self.assertEqual(UserGroupMix.max_level(session, other), 0)
+
+    def test_user_mix_get_by_name(self):
+        session = self.__session__
+        with self.count_statements() as statements:
+            for i in range(3):
+                self.assertIsNone(UserMixModel.get_by_name(session, "bob"))
+            self.assertEqual(len(statements), 1)
+
+            bob = UserMixModel(name="bob")
+            session.add(bob)
+            session.commit()
+            self.assertIs(UserMixModel.get_by_name(session, "bob"), bob)
+            del statements[:]
+            self.assertIs(UserMixModel.get_by_name(session, "bob"), bob)
+            self.assertEqual(statements, [])
+
+        bob.name = "robert"
+        session.commit()
+        self.assertIsNone(UserMixModel.get_by_name(session, "bob"))
+        self.assertIs(UserMixModel.get_by_name(session, "robert"), bob)
+        session.delete(bob)
+        session.commit()
+        self.assertIsNone(UserMixModel.get_by_name(session, "robert"))
+        self.assertIsNone(UserMixEncModel.get_by_name(session, "robert"))
+
+    def test_user_mix_get_by_name_renamed(self):
+        session = self.__session__
+        alice = UserMixModel(name="alice")
+        session.add(alice)
+        session.commit()
+        self.assertIs(UserMixModel.get_by_name(session, "alice"), alice)
+        alice_id = alice.id
+        session.remove()
+
+        # Renamed by another process; no session events here.
+        renamed, other = UserMixModel(name="bob"), UserMixModel(name="alice")
+        table = UserMixModel.__table__
+        with self.__engine__.begin() as connection:
+            connection.execute(table.update().where(table.c.id == alice_id)
+                                   .values(name=renamed.name,
+                                           namehash=renamed._UserMix__namehash))
+            connection.execute(table.insert().values(name=other.name,
+                                                     namehash=other._UserMix__namehash))
+        user = UserMixModel.get_by_name(self.__session__, "alice")
+        self.assertNotEqual(user.id, alice_id)
+        self.assertEqual(user.name, "alice")
+
+    def test_user_mix_provision(self):
+        session = self.__session__
+        self.assertIsNone(UserMixEncModel.get_by_name(session, "user7"))
+        calls = []
+        pairs = [("user%s" % i, "pass%s" % i) for i in range(25)]
+        self.assertEqual(UserMixEncModel.provision(session, pairs,
+                            chunk_size=10,
+                            progress=lambda *args: calls.append(args)), 25)
+        session.commit()
+        self.assertEqual(calls, [(10, 25), (20, 25), (25, 25)])
+        # Hashed in the shared process pool by default.
+        self.assertIsInstance(apothecary.util._process_executor,
+                              concurrent.futures.ProcessPoolExecutor)
+
+        users = session.query(UserMixEncModel).all()
+        self.assertEqual(len(users), 25)
+        self.assertEqual(len(set(user._salt for user in users)), 25)
+        user = UserMixEncModel.get_by_name(session, "user7")
+        self.assertTrue(user.challenge("pass7"))
+        self.assertFalse(user.challenge("pass8"))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as pool:
+            UserMixKdfModel.provision(session, [("kdf", "secret")],
+                                      executor=pool)
+        session.commit()
+        self.assertTrue(UserMixKdfModel.get_by_name(session, "kdf")
+                            .challenge("secret"))
+        self.assertEqual(UserMixKdfModel.provision(session, []), 0)
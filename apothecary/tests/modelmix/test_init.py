@@ -1,7 +1,12 @@
 import unittest
+import threading
 import sqlalchemy
 import sqlalchemy.types
+import sqlalchemy.event
+import sqlalchemy.orm
 import sqlalchemy.ext.declarative
+import apothecary.util
+import apothecary.query
 import apothecary.modelmix
 
 from apothecary.tests import SqlaTestCase
@@ -25,11 +30,42 @@ class TsModel2(Base, apothecary.modelmix.ts_mix('ts_created'),
     id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
 
 
+class TsDeferModel(Base, apothecary.modelmix.ts_mix('ts', oncreate=True,
+                                                    defer=True)):
+    __tablename__ = "test_ts_defer_mix"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+class TsServerModel(Base,
+        apothecary.modelmix.ts_mix('ts_created', oncreate=True,
+                                   server_side=True),
+        apothecary.modelmix.ts_mix('ts_updated', onupdate=True,
+                                   server_side=True)):
+    __tablename__ = "test_ts_server_mix"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+    name = sqlalchemy.Column(sqlalchemy.types.String(16))
+
+
 class FlagModel(Base, apothecary.modelmix.flag_mix('flag')):
     __tablename__ = "test_flag_mix"
     id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
 
 
+class SoftModel(Base, apothecary.modelmix.ActiveMix,
+                apothecary.modelmix.DeletableMix):
+    __tablename__ = "test_flag_filter"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+class FlagIndexModel(Base,
+        apothecary.modelmix.flag_mix('deleted', invert_filter=True,
+                                     partial_index=True),
+        apothecary.modelmix.flag_ts_mix('activated', 'activated_ts',
+                                        index=True, partial_index=True)):
+    __tablename__ = "test_flag_index"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
 class FlagTsModel(Base, apothecary.modelmix.flag_ts_mix('flag', 'flag_ts',
                                 default_flag=True)):
     __tablename__ = "test_flag_ts_mix"
@@ -45,6 +81,49 @@ class LookupMixModel(Base, apothecary.modelmix.lookup_mix()):
     __tablename__ = "test_lookup_mix"
     id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
 
+
+class UniqueModel(Base, apothecary.modelmix.UniqueMix):
+    __tablename__ = "test_unique_mix"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+    name = sqlalchemy.Column(sqlalchemy.types.String(32), unique=True)
+    __unique_attrs__ = ('name',)
+
+    @classmethod
+    def unique_hash(cls, name):
+        return name
+
+    @classmethod
+    def unique_filter(cls, query, name):
+        return query.filter(cls.name == name)
+
+
+class ConstructorModel(apothecary.modelmix.ConstructorMix, Base):
+    __tablename__ = "test_constructor_mix"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+    _title = sqlalchemy.Column('title', sqlalchemy.types.String(32))
+
+    @property
+    def _label(self):
+        return self._title
+
+    @_label.setter
+    def _label(self, value):
+        self._title = value.title()
+
+    label = apothecary.util.synonym('_label')
+
+
+class ConstructorStrictModel(ConstructorModel):
+    __constructor_strict__ = True
+
+
+class BulkModel(apothecary.modelmix.ConstructorMix, Base,
+                apothecary.modelmix.ts_mix('ts', oncreate=True),
+                apothecary.modelmix.flag_mix('flag', default=True)):
+    __tablename__ = "test_bulk_create"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+    name = sqlalchemy.Column(sqlalchemy.types.String(32))
+
 '''
 # Borken
 class AssociationLeft(Base):
@@ -108,6 +187,40 @@ class TestModelMix(SqlaTestCase):
         self.assertIs(id_obj, queried_id_obj)
         self.assertEqual(id_obj.id, 1)
 
+    def test_constructor_mix(self):
+        obj = ConstructorModel(id=1, title=u"plain", nope=1)
+        self.assertEqual((obj.id, obj._title), (1, u"plain"))
+        self.assertFalse(hasattr(obj, 'nope'))
+        obj = ConstructorModel(label=u"set by label")
+        self.assertEqual(obj._title, u"Set By Label")
+        self.assertIn('label', apothecary.modelmix._constructor_plan(
+                                                            ConstructorModel))
+
+        self.assertEqual(ConstructorStrictModel(label=u"a")._title, u"A")
+        self.assertRaises(TypeError, ConstructorStrictModel, nope=1)
+
+    def test_bulk_create(self):
+        session = self.__session__
+        rows = [{'name': u"a"}, {'name': u"b", 'flag': False},
+                {'name': u"c", 'ts': 5}, {'name': u"d"}]
+        pks = BulkModel.bulk_create(session, rows, return_defaults=True,
+                                    chunk_size=3)
+        session.commit()
+        self.assertEqual(len(set(pks)), 4)
+        objs = [session.get(BulkModel, pk) for pk in pks]
+        self.assertEqual([obj.name for obj in objs], [u"a", u"b", u"c", u"d"])
+        self.assertEqual([obj.flag for obj in objs], [True, False, True, True])
+        self.assertEqual(objs[2].ts, 5)
+        self.assertTrue(objs[0].ts >= apothecary.util.time() - 5)
+
+        self.assertIsNone(BulkModel.bulk_create(session, [{'name': u"e",
+                                                           'nope': 1}]))
+        self.assertEqual(session.query(BulkModel).count(), 5)
+        self.assertRaises(TypeError, ConstructorModel.bulk_create, session,
+                          [{'label': u"set on instances only"}])
+        self.assertRaises(TypeError, ConstructorStrictModel.bulk_create,
+                          session, [{'nope': 1}])
+
     def test_ts_mix(self):
         ts_obj = TsModel()
         ts_obj.ts_set_now()
@@ -119,6 +232,41 @@ class TestModelMix(SqlaTestCase):
         self.assertIs(ts_obj, queried_ts_obj)
         self.assertGreater(queried_ts_obj.ts, 1402776709)
 
+    def test_ts_mix_defer(self):
+        self.add(TsDeferModel())
+        self.__session__.remove()
+
+        ts_obj = self.query(TsDeferModel).first()
+        self.assertNotIn('ts', sqlalchemy.inspect(ts_obj).dict)
+        self.assertGreater(ts_obj.ts, 1402776709)
+        self.__session__.remove()
+
+        ts_obj = (self.query(TsDeferModel)
+                    .options(*apothecary.query.undefer_groups('audit'))
+                    .first())
+        self.assertIn('ts', sqlalchemy.inspect(ts_obj).dict)
+
+    def test_ts_mix_server_side(self):
+        ts_obj = TsServerModel(name="a")
+        self.__session__.add(ts_obj)
+        self.__session__.commit()
+        self.assertGreater(ts_obj.ts_created, 1402776709)
+        self.assertGreater(ts_obj.ts_updated, 1402776709)
+
+        # Core executemany with no Python side defaults.
+        self.__session__.execute(TsServerModel.__table__.insert(),
+                                 [dict(name=str(i)) for i in range(5)])
+        self.__session__.commit()
+        self.assertEqual(self.query(TsServerModel)
+                            .filter(TsServerModel.ts_created > 1402776709)
+                            .count(), 6)
+
+        ts_obj.ts_updated = 0
+        self.__session__.commit()
+        ts_obj.name = "b"
+        self.__session__.commit()
+        self.assertGreater(ts_obj.ts_updated, 1402776709)
+
     def test_flag_mix(self):
         flag_obj = FlagModel()
         self.__session__.add(flag_obj)
@@ -135,6 +283,74 @@ class TestModelMix(SqlaTestCase):
         queried_flag_obj = self.__session__.query(FlagModel).first()
         self.assertIs(queried_flag_obj.flag, False)
 
+    def test_flag_filter(self):
+        self.__session__.add_all([
+            SoftModel(active=True, deleted=False),
+            SoftModel(active=False, deleted=False),
+            SoftModel(active=True, deleted=True),
+            FlagModel(flag=True), FlagModel(flag=False)])
+        self.__session__.commit()
+        self.__session__.remove()
+
+        apothecary.modelmix.flag_filter(self.__session__)
+        try:
+            visible = self.query(SoftModel).all()
+            self.assertEqual(len(visible), 1)
+            self.assertEqual(self.query(SoftModel).count(), 1)
+            self.assertEqual(self.query(
+                                sqlalchemy.orm.aliased(SoftModel)).count(), 1)
+            # Only flags created with `auto_filter` filter.
+            self.assertEqual(self.query(FlagModel).count(), 2)
+            self.assertTrue(visible[0].__filter__)
+            self.assertEqual(self.query(SoftModel)
+                                .execution_options(flag_filter=False)
+                                .count(), 3)
+            self.assertEqual(self.query(SoftModel)
+                                .filter(SoftModel.deleted == True).all(), [])
+        finally:
+            sqlalchemy.event.remove(self.__session__, 'do_orm_execute',
+                                    apothecary.modelmix.filter_flags)
+        self.assertEqual(self.query(SoftModel).count(), 3)
+
+        # Mapping more flagged models adds no loader options.
+        options = list(apothecary.modelmix._flag_filter_options)
+        for i in range(5):
+            class Throwaway(sqlalchemy.ext.declarative.declarative_base(),
+                            apothecary.modelmix.DeletableMix):
+                __tablename__ = "test_flag_throwaway"
+                id = sqlalchemy.Column(sqlalchemy.types.Integer,
+                                       primary_key=True)
+            sqlalchemy.orm.configure_mappers()
+        self.assertEqual(apothecary.modelmix._flag_filter_options, options)
+
+    def test_flag_index(self):
+        coverage = dict(apothecary.modelmix.flag_index_coverage(FlagIndexModel))
+        self.assertEqual(sorted(coverage), [
+            "ix_test_flag_index_activated_activated_ts",
+            "ix_test_flag_index_activated_ts_partial",
+            "ix_test_flag_index_deleted_partial"])
+        self.assertIn("WHERE activated = ? ORDER BY activated_ts",
+                      coverage["ix_test_flag_index_activated_activated_ts"])
+        self.assertIn("WHERE activated (filter) ORDER BY activated_ts",
+                      coverage["ix_test_flag_index_activated_ts_partial"])
+
+        # The flag filter criterion matches the partial index predicate.
+        query = (self.query(FlagIndexModel.id)
+                    .filter(FlagIndexModel.__filter__))
+        plan = self.__session__.execute(sqlalchemy.text(
+                    "EXPLAIN QUERY PLAN " + str(query.statement.compile(
+                        self.__engine__)))).fetchall()
+        self.assertIn("ix_test_flag_index_deleted_partial",
+                      " ".join(str(row) for row in plan))
+
+        query = (self.query(FlagIndexModel.id)
+                    .filter(FlagIndexModel.activated == sqlalchemy.true())
+                    .order_by(FlagIndexModel.activated_ts))
+        plan = self.__session__.execute(sqlalchemy.text(
+                    "EXPLAIN QUERY PLAN " + str(query.statement.compile(
+                        self.__engine__)))).fetchall()
+        self.assertNotIn("TEMP B-TREE", " ".join(str(row) for row in plan))
+
     def test_flag_ts_mix(self):
         flag_obj = FlagTsModel()
         self.__session__.add(flag_obj)
@@ -145,6 +361,40 @@ class TestModelMix(SqlaTestCase):
         self.assertIs(queried_flag_obj.flag, True)
         self.assertGreater(queried_flag_obj.flag_ts, 1402776709)
 
+    def test_flag_bulk(self):
+        objs = [FlagTsModel() for i in range(10)]
+        self.__session__.add_all(objs)
+        self.__session__.commit()
+
+        count = FlagTsModel.bulk_unset_flag(self.__session__,
+                                            FlagTsModel.id > 5)
+        self.assertEqual(count, 5)
+        self.assertIs(objs[9].flag, False)
+        self.assertIsNone(objs[9].flag_ts)
+        self.assertIs(objs[0].flag, True)
+
+        # No criteria or pks updates nothing without `all=True`.
+        self.assertRaises(ValueError, FlagTsModel.bulk_unset_flag,
+                          self.__session__)
+        self.assertIs(objs[0].flag, True)
+
+        count = FlagTsModel.bulk_set_flag(self.__session__,
+                                          pks=[obj.id for obj in objs[8:]])
+        self.assertEqual(count, 2)
+        self.__session__.commit()
+        self.assertEqual(self.query(FlagTsModel)
+                            .filter(FlagTsModel.flag == False).count(), 3)
+        self.assertGreater(objs[9].flag_ts, 1402776709)
+
+        ts_objs = [TsModel() for i in range(3)]
+        self.__session__.add_all(ts_objs)
+        self.__session__.commit()
+        self.assertRaises(ValueError, TsModel.bulk_ts_set_now,
+                          self.__session__)
+        self.assertEqual(TsModel.bulk_ts_set_now(self.__session__,
+                                                 all=True), 3)
+        self.assertGreater(ts_objs[0].ts, 1402776709)
+
     def test_sequence_mix(self):
         seq_obj = SequenceMixModel()
         self.__session__.add(seq_obj)
@@ -162,6 +412,27 @@ class TestModelMix(SqlaTestCase):
         self.assertIs(seq_obj, queried_seq_obj)
         self.assertEqual(seq_obj.sequence, 1)
 
+    def test_sequence_mix_atomic(self):
+        seq_obj = SequenceMixModel()
+        self.add(seq_obj)
+
+        # A second session increments the same row concurrently.
+        other_session = sqlalchemy.orm.sessionmaker(bind=self.__engine__)()
+        other_obj = other_session.query(SequenceMixModel).first()
+        self.assertEqual(other_obj._sequence_inc(), 1)
+        other_session.commit()
+        other_session.close()
+
+        self.assertEqual(seq_obj._sequence_inc(), 2)
+        self.assertEqual(list(seq_obj.reserve_sequence(3)), [3, 4, 5])
+        self.assertEqual(seq_obj._sequence_dec(), 4)
+        self.assertNotIn(seq_obj, self.__session__.dirty)
+        self.__session__.commit()
+        self.assertEqual(seq_obj.sequence, 4)
+
+        pending = SequenceMixModel()
+        self.assertEqual(list(pending.reserve_sequence(2)), [1, 2])
+
     def test_lookup_mix(self):
         lookup_obj = LookupMixModel()
         lookup_obj.key = u"test"
@@ -173,6 +444,191 @@ class TestModelMix(SqlaTestCase):
         self.assertIs(lookup_obj, queried_lookup_obj)
         self.assertEqual(queried_lookup_obj.key, u"test")
         self.assertEqual(queried_lookup_obj.value, u"This is a test.")
+
+    def test_lookup_mix_cache(self):
+        LookupMixModel.invalidate()
+        session = self.__session__
+        session.add_all([LookupMixModel(key=u"a", desc=u"Alpha"),
+                         LookupMixModel(key=u"b", desc=u"Beta")])
+        session.commit()
+
+        with self.count_statements() as statements:
+            self.assertEqual(LookupMixModel.get(session, u"a").desc, u"Alpha")
+            self.assertEqual(len(statements), 1)
+            self.assertEqual([row and row.desc for row in
+                              LookupMixModel.get_many(session,
+                                                      [u"b", u"x", u"a"])],
+                             [u"Beta", None, u"Alpha"])
+            self.assertIsNone(LookupMixModel.get(session, u"x"))
+            self.assertEqual(len(statements), 1)
+
+        # Commits touching the table invalidate.
+        other_session = sqlalchemy.orm.sessionmaker(bind=self.__engine__)()
+        other_session.query(LookupMixModel).filter_by(key=u"a").one().desc = u"A"
+        other_session.rollback()
+        self.assertEqual(LookupMixModel.get(session, u"a").desc, u"Alpha")
+        other_session.query(LookupMixModel).filter_by(key=u"a").one().desc = u"A"
+        other_session.commit()
+        other_session.close()
+        session.rollback()
+        self.assertEqual(LookupMixModel.get(session, u"a").desc, u"A")
+
+        # Rolled back rows read through a session are dropped.
+        session.add(LookupMixModel(key=u"tmp", desc=u"uncommitted"))
+        session.flush()
+        LookupMixModel.invalidate()
+        self.assertEqual(LookupMixModel.get(session, u"tmp").desc,
+                         u"uncommitted")
+        session.rollback()
+        self.assertIsNone(LookupMixModel.get(session, u"tmp"))
+
+        # Inserts through ORM and Core statements.
+        session.execute(sqlalchemy.insert(LookupMixModel),
+                        [{'key': u"c", 'desc': u"Gamma"}])
+        session.commit()
+        self.assertEqual(LookupMixModel.get(session, u"c").desc, u"Gamma")
+        session.execute(LookupMixModel.__table__.insert(),
+                        [{'key': u"d", 'desc': u"Delta"}])
+        session.commit()
+        self.assertEqual(LookupMixModel.get(session, u"d").desc, u"Delta")
+
+        # Expired after `__lookup_ttl__`.
+        LookupMixModel.__lookup_ttl__ = -1
+        try:
+            LookupMixModel.invalidate()
+            self.assertEqual(LookupMixModel.get(session, u"b").desc, u"Beta")
+            session.execute(LookupMixModel.__table__.delete()
+                                .where(LookupMixModel.key == u"b"))
+            self.assertIsNone(LookupMixModel.get(session, u"b"))
+        finally:
+            del LookupMixModel.__lookup_ttl__
+        session.rollback()
+        LookupMixModel.invalidate()
+
+    def test_lookup_mix_concurrent_invalidate(self):
+        LookupMixModel.invalidate()
+        session = self.__session__
+        session.add(LookupMixModel(key=u"a", desc=u"Alpha"))
+        session.commit()
+
+        # Invalidated by another thread while loading; not stored.
+        invalidated = []
+        def during_load(orm_execute_state):
+            thread = threading.Thread(target=LookupMixModel.invalidate)
+            thread.start()
+            thread.join(5)
+            invalidated.append(not thread.is_alive())
+        sqlalchemy.event.listen(session, 'do_orm_execute', during_load)
+        try:
+            self.assertEqual(LookupMixModel.get(session, u"a").desc,
+                             u"Alpha")
+        finally:
+            sqlalchemy.event.remove(session, 'do_orm_execute', during_load)
+        self.assertEqual(invalidated, [True])
+        with self.count_statements() as statements:
+            LookupMixModel.get(session, u"a")
+            LookupMixModel.get(session, u"a")
+        self.assertEqual(len(statements), 1)
+        LookupMixModel.invalidate()
+
+    def test_unique_mix(self):
+        tag = UniqueModel.as_unique(self.__session__, name="tag")
+        self.assertIs(UniqueModel.as_unique(self.__session__, name="tag"), tag)
+        cache = apothecary.util.unique_cache(self.__session__)
+        self.assertEqual(cache.hits, 1)
+        self.__session__.commit()
+
+        # Rolled back objects are not served from the cache.
+        other = UniqueModel.as_unique(self.__session__, name="other")
+        self.__session__.rollback()
+        self.assertEqual(len(cache), 0)
+        self.assertIsNot(UniqueModel.as_unique(self.__session__, name="other"),
+                         other)
+        self.assertIs(UniqueModel.as_unique(self.__session__, name="tag"), tag)
+
+        # Bounded.
+        for i in range(5):
+            UniqueModel.as_unique(self.__session__, name="tag%s" % i)
+        small = apothecary.util.UniqueCache(maxsize=2)
+        for i in range(5):
+            small.store(i, tag)
+        self.assertEqual(len(small), 2)
+        self.__session__.commit()
+
+    def test_unique_mix_many(self):
+        tag = UniqueModel.as_unique(self.__session__, name="tag0")
+        self.__session__.commit()
+        tag_id = tag.id
+        self.__session__.remove()
+        existing = UniqueModel.as_unique(self.__session__, name="tag1")
+
+        names = [("tag%s" % i,) for i in range(10)] + [("tag3",),
+                                                       dict(name="tag4")]
+        objs = UniqueModel.as_unique_many(self.__session__, names,
+                                          chunk_size=3)
+        self.assertEqual([obj.name for obj in objs],
+                         ["tag%s" % i for i in range(10)] + ["tag3", "tag4"])
+        self.assertEqual(objs[0].id, tag_id)
+        self.assertIs(objs[1], existing)
+        self.assertIs(objs[3], objs[10])
+        self.__session__.commit()
+        self.assertEqual(self.query(UniqueModel).count(), 10)
+
+        self.__session__.remove()
+        objs = UniqueModel.as_unique_many(self.__session__,
+                    [dict(name="tag%s" % i) for i in range(5, 15)],
+                    upsert=True)
+        self.assertEqual([obj.name for obj in objs],
+                         ["tag%s" % i for i in range(5, 15)])
+        self.assertEqual(self.query(UniqueModel).count(), 15)
+
+    def test_unique_mix_pending_eviction(self):
+        UniqueModel.__unique_cache_size__ = 3
+        try:
+            tags = [UniqueModel.as_unique(self.__session__, name="tag%s" % i)
+                        for i in range(5)]
+            self.assertIs(UniqueModel.as_unique(self.__session__,
+                                                name="tag0"), tags[0])
+            self.__session__.commit()
+            self.assertEqual(self.query(UniqueModel).count(), 5)
+            # Flushed objects are evicted again and found by query.
+            self.assertIs(UniqueModel.as_unique(self.__session__,
+                                                name="tag1"), tags[1])
+        finally:
+            del UniqueModel.__unique_cache_size__
+
+    def test_unique_mix_many_over_cache_size(self):
+        UniqueModel.__unique_cache_size__ = 5
+        try:
+            self.__session__.add(UniqueModel(name="tag0"))
+            self.__session__.commit()
+            names = [("tag%s" % i,) for i in range(12)]
+            objs = UniqueModel.as_unique_many(self.__session__, names)
+            self.assertEqual([obj.name for obj in objs],
+                             ["tag%s" % i for i in range(12)])
+            self.__session__.commit()
+            objs = UniqueModel.as_unique_many(self.__session__, names)
+            self.assertNotIn(None, objs)
+            self.assertEqual(self.query(UniqueModel).count(), 12)
+        finally:
+            del UniqueModel.__unique_cache_size__
+
+    def test_unique_mix_shared(self):
+        shared = apothecary.util.UniqueCache(shared=True)
+        UniqueModel.__unique_cache__ = shared
+        try:
+            tag = UniqueModel.as_unique(self.__session__, name="tag")
+            self.__session__.commit()
+            self.assertIs(UniqueModel.as_unique(self.__session__, name="tag"),
+                          tag)
+            self.assertEqual(len(shared), 1)
+
+            self.__session__.remove()
+            tag = UniqueModel.as_unique(self.__session__, name="tag")
+            self.assertEqual(tag.name, "tag")
+            self.assertEqual(shared.hits, 1)
+        finally:
+            UniqueModel.__unique_cache__ = None
     '''
     def test_association_mix(self):
         left1 = AssociationLeft(name="left1")
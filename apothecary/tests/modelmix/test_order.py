@@ -0,0 +1,86 @@
+import sqlalchemy
+import sqlalchemy.types
+import sqlalchemy.ext.declarative
+import apothecary.modelmix.order
+
+from apothecary.tests import SqlaTestCase
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+
+class OrderedModel(Base, apothecary.modelmix.order.ordered_mix(
+                                    'position', gap=4, scope=('list_id',))):
+    __tablename__ = "test_ordered_mix"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+    list_id = sqlalchemy.Column(sqlalchemy.types.Integer, nullable=False)
+    name = sqlalchemy.Column(sqlalchemy.types.String(16))
+
+
+class TestOrderModelMix(SqlaTestCase):
+    __base__ = Base
+
+    def names(self, list_id=1):
+        return [obj.name for obj in self.query(OrderedModel)
+                    .filter(OrderedModel.list_id == list_id)
+                    .order_by(OrderedModel.position)]
+
+    def test_append(self):
+        session = self.__session__
+        for name in "abc":
+            OrderedModel.append(session, OrderedModel(list_id=1, name=name))
+        OrderedModel.append(session, OrderedModel(list_id=2, name="z"))
+        session.commit()
+        self.assertEqual(self.names(), ["a", "b", "c"])
+        self.assertEqual([obj.position for obj in self.query(OrderedModel)
+                            .order_by(OrderedModel.id)], [4, 8, 12, 4])
+
+    def test_move(self):
+        session = self.__session__
+        a, b, c = [OrderedModel.append(session,
+                                       OrderedModel(list_id=1, name=name))
+                        for name in "abc"]
+        session.commit()
+
+        OrderedModel.move(session, c, before=a)
+        self.assertEqual(list(session.dirty), [c])
+        session.commit()
+        self.assertEqual(self.names(), ["c", "a", "b"])
+
+        OrderedModel.move(session, c, after=b)
+        session.commit()
+        self.assertEqual(self.names(), ["a", "b", "c"])
+
+        OrderedModel.move(session, a, after=b)
+        session.commit()
+        self.assertEqual(self.names(), ["b", "a", "c"])
+
+    def test_move_rebalance(self):
+        session = self.__session__
+        a, b, c = [OrderedModel.append(session,
+                                       OrderedModel(list_id=1, name=name))
+                        for name in "abc"]
+        other = OrderedModel.append(session, OrderedModel(list_id=2, name="z"))
+        session.commit()
+        # Gap of 4 runs out after two moves into the same slot.
+        OrderedModel.move(session, c, after=a)
+        session.commit()
+        OrderedModel.move(session, b, after=a)
+        session.commit()
+        self.assertEqual(self.names(), ["a", "b", "c"])
+        OrderedModel.move(session, c, after=a)
+        session.commit()
+        self.assertEqual(self.names(), ["a", "c", "b"])
+        self.assertEqual(other.position, 4)
+
+    def test_rebalance(self):
+        session = self.__session__
+        for name in "abc":
+            OrderedModel.append(session, OrderedModel(list_id=1, name=name))
+        session.commit()
+        session.execute(sqlalchemy.update(OrderedModel.__table__)
+                            .values(position=OrderedModel.position * 3 + 1))
+        OrderedModel.rebalance(session)
+        session.commit()
+        self.assertEqual([obj.position for obj in self.query(OrderedModel)
+                            .order_by(OrderedModel.position)], [4, 8, 12])
+        self.assertEqual(self.names(), ["a", "b", "c"])
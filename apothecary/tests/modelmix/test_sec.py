@@ -24,6 +24,19 @@ class RecordTokenMixModel(Base, apothecary.modelmix.sec.record_token_mix('token'
     id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
 
 
+class RecordTokenDeferModel(Base,
+        apothecary.modelmix.sec.record_token_mix('token', defer=True)):
+    __tablename__ = "test_record_token_defer"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+class RecordTokenBulkModel(apothecary.modelmix.ConstructorMix, Base,
+        apothecary.modelmix.sec.record_token_mix('token',
+                                                 binary_encode=True)):
+    __tablename__ = "test_record_token_bulk"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
 class UrlTokenMixModel(Base, apothecary.modelmix.sec.url_token_mix()):
     __tablename__ = "test_url_token_mix"
     id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
@@ -46,6 +59,25 @@ class TestSecModelMix(SqlaTestCase):
 
         self.assertEqual(len(queried_token_obj.token), 6)
 
+    def test_record_token_mix_defer(self):
+        self.__session__.add(RecordTokenDeferModel())
+        self.__session__.commit()
+        self.__session__.remove()
+
+        token_obj = self.__session__.query(RecordTokenDeferModel).first()
+        self.assertNotIn('_token', sqlalchemy.inspect(token_obj).dict)
+        self.assertEqual(len(token_obj.token), 6)
+
+    def test_record_token_mix_bulk_create(self):
+        RecordTokenBulkModel.bulk_create(self.__session__,
+                                         [{} for i in range(50)])
+        self.__session__.commit()
+        tokens = [obj.token for obj in
+                    self.__session__.query(RecordTokenBulkModel)]
+        self.assertEqual(len(tokens), 50)
+        self.assertEqual(len(set(tokens)), 50)
+        self.assertEqual(set(len(token) for token in tokens), set([6]))
+
     def test_url_token_mix(self):
         url_token_obj = UrlTokenMixModel()
         url_token_obj.upd = "test"
@@ -60,4 +92,26 @@ class TestSecModelMix(SqlaTestCase):
         queried_by_url = (self.__session__.query(UrlTokenMixModel)
                     .filter(UrlTokenMixModel.securlid==queried_obj.securlid).one())
 
-        self.assertIs(url_token_obj, queried_by_url)
\ No newline at end of file
+        self.assertIs(url_token_obj, queried_by_url)
+
+    def test_validate_securl(self):
+        url_token_obj = UrlTokenMixModel()
+        self.__session__.add(url_token_obj)
+        self.__session__.commit()
+
+        securl = url_token_obj.get_securl(b"reset")
+        self.assertTrue(url_token_obj.validate_securl(securl, b"reset"))
+        self.assertTrue(url_token_obj.validate_securl(securl.decode(),
+                                                      b"reset"))
+        self.assertFalse(url_token_obj.validate_securl(securl))
+        self.assertFalse(url_token_obj.validate_securl(securl[:-4], b"reset"))
+        self.assertFalse(url_token_obj.validate_securl(b"not base64!",
+                                                       b"reset"))
+        # Non-canonical encodings of the same digest.
+        self.assertFalse(url_token_obj.validate_securl(
+                            b"!!" + securl[:10] + b"$$" + securl[10:],
+                            b"reset"))
+        self.assertFalse(url_token_obj.validate_securl(
+                            b"+/" + securl[:-4], b"reset"))
+        self.assertFalse(url_token_obj.validate_securl(u"\u00e9" +
+                            securl.decode(), b"reset"))
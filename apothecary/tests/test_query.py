@@ -64,3 +64,82 @@ class TestDictQuery(SqlaTestCase):
         self.assertGreater(len(query(name=first.name).all()), 0)
         self.assertGreater(len(query(desc=first.desc).all()), 0)
         self.assertGreater(len(query(status=first.status).all()), 0)
+
+    def test_dict_query_cache(self):
+        query = apothecary.query.dict_query(TestModel,
+                                            session=self.__session__,
+                                            cache=True)
+        first = self.__session__.query(TestModel).first()
+        expected = (self.__session__.query(TestModel)
+                        .filter(TestModel.name == first.name,
+                                TestModel.status == first.status).all())
+
+        self.assertEqual(query(name=first.name, status=first.status).all(),
+                         expected)
+        plan = apothecary.query.filter_plan(TestModel, ('status', 'name'))
+        self.assertIs(plan, apothecary.query.filter_plan(TestModel,
+                                                         ('name', 'status')))
+        self.assertEqual(query(name=first.name, status=first.status).all(),
+                         expected)
+        self.assertRaises(KeyError, query, nope=1)
+
+        # Bound plans of the same shape must not share values.
+        names = set(self.names[:2])
+        expected = (self.__session__.query(TestModel)
+                        .filter(TestModel.name.in_(names)).all())
+        union = query(name=self.names[0]).union(query(name=self.names[1]))
+        self.assertEqual(set(union.all()), set(expected))
+        subquery = query(name=self.names[0]).with_entities(TestModel.id)
+        self.assertEqual(query(name=self.names[1])
+                            .filter(TestModel.id.in_(subquery)).all(), [])
+
+    def test_dict_query_any(self):
+        query = apothecary.query.dict_query(TestModel,
+                                            session=self.__session__,
+                                            any=True)
+        first = self.__session__.query(TestModel).first()
+        self.assertGreater(len(query(name=first.name, status=-1).all()), 0)
+
+    def test_dict_query_many(self):
+        objs = self.__session__.query(TestModel).limit(10).all()
+        kwa_list = [dict(name=obj.name, status=obj.status) for obj in objs]
+        kwa_list.append(dict(name=u'Nobody', status=-1))
+        kwa_list.append(dict(status=objs[0].status))
+
+        results = apothecary.query.dict_query_many(TestModel,
+                                                   self.__session__,
+                                                   kwa_list, chunk_size=3)
+        self.assertEqual(len(results), len(kwa_list))
+        for obj, result in zip(objs, results):
+            self.assertIn(obj, result)
+        self.assertEqual(results[-2], [])
+        self.assertEqual(results[-1],
+                         apothecary.query.dict_query(TestModel,
+                            session=self.__session__)(
+                                status=objs[0].status).all())
+
+        # Values are matched after conversion to the column type.
+        results = apothecary.query.dict_query_many(TestModel,
+                                                   self.__session__,
+                                                   [dict(id=str(objs[0].id)),
+                                                    dict(id=objs[0].id)])
+        self.assertEqual(results, [[objs[0]], [objs[0]]])
+
+    def test_dict_query_iter(self):
+        stream = apothecary.query.dict_query_iter(TestModel,
+                                                  session=self.__session__,
+                                                  page_size=7)
+        ids = [obj.id for obj in stream()]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 100)
+
+        first = self.__session__.query(TestModel).first()
+        expected = (self.__session__.query(TestModel.name, TestModel.id)
+                        .filter(TestModel.name == first.name)
+                        .order_by(TestModel.id).all())
+        stream = apothecary.query.dict_query_iter(TestModel,
+                                                  session=self.__session__,
+                                                  page_size=3,
+                                                  columns=('name',))
+        self.assertEqual([tuple(row) for row in stream(name=first.name)],
+                         [tuple(row) for row in expected])
@@ -0,0 +1,77 @@
+"""
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import sqlalchemy
+import sqlalchemy.ext.declarative
+
+import apothecary.modelmix
+import apothecary.snapshot
+
+from apothecary.tests import SqlaTestCase
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+
+class SnapshotLookupModel(Base, apothecary.modelmix.lookup_mix(ext_col='ext')):
+    __tablename__ = "test_snapshot_lookup"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+class TestSnapshot(SqlaTestCase):
+    __base__ = Base
+
+    def setUp(self):
+        SqlaTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "lookup.snap")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        SqlaTestCase.tearDown(self)
+
+    def test_snapshot(self):
+        rows = [(u"b", u"Beta", None), (u"é", u"E", u"acute"),
+                (u"a", None, u"")]
+        apothecary.snapshot.write_snapshot(self.path, rows)
+        with apothecary.snapshot.LookupSnapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 3)
+            self.assertEqual(list(snapshot), sorted(rows))
+            self.assertEqual(snapshot.get(u"a"), (u"a", None, u""))
+            self.assertEqual(snapshot.get(u"é"), (u"é", u"E", u"acute"))
+            self.assertIsNone(snapshot.get(u"c"))
+            self.assertIn(u"b", snapshot)
+            self.assertNotIn(u"", snapshot)
+            self.assertEqual(snapshot.get_many([u"c", u"b"], default=()),
+                             [(), (u"b", u"Beta", None)])
+        self.assertEqual(os.listdir(self.dir), ["lookup.snap"])
+        umask = os.umask(0o022)
+        try:
+            apothecary.snapshot.write_snapshot(self.path, rows)
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
+
+        apothecary.snapshot.write_snapshot(self.path, [])
+        with apothecary.snapshot.LookupSnapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 0)
+            self.assertIsNone(snapshot.get(u"a"))
+
+        with open(self.path, "wb") as f:
+            f.write(b"nope" + b"\0" * 16)
+        self.assertRaises(ValueError, apothecary.snapshot.LookupSnapshot,
+                          self.path)
+
+    def test_dump_snapshot(self):
+        session = self.__session__
+        session.add_all([SnapshotLookupModel(key=str(i), desc=u"v%s" % i)
+                            for i in range(100)])
+        session.commit()
+        SnapshotLookupModel.dump_snapshot(session, self.path)
+        with apothecary.snapshot.LookupSnapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 100)
+            self.assertEqual(snapshot.get(u"42"), (u"42", u"v42", None))
+            self.assertEqual(snapshot.get(u"99"), (u"99", u"v99", None))
+            self.assertIsNone(snapshot.get(u"100"))
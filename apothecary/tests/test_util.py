@@ -16,6 +16,22 @@ class TestUtil(unittest.TestCase):
         dig = apothecary.util.hash('minessssss'.encode())
         self.assertEqual(len(dig), 64)
 
+    def test_hash_profiles(self):
+        for name in ('default', 'token', 'password'):
+            profile = apothecary.util.hash_profile(name)
+            dig = profile('mine'.encode(), 'salt'.encode())
+            self.assertEqual(len(dig), profile.digest_length)
+            self.assertEqual(dig, profile('mine'.encode(), 'salt'.encode()))
+        self.assertIs(apothecary.util.hash_profile(apothecary.util.hash),
+                      apothecary.util.hash)
+        self.assertRaises(KeyError, apothecary.util.hash_profile, 'nope')
+
+        fast = apothecary.util.Pbkdf2Profile('sha256', iterations=10,
+                                             digest_length=16)
+        apothecary.util.register_hash_profile('fast', fast)
+        self.assertEqual(len(apothecary.util.hash_profile('fast')(
+                                'mine'.encode())), 16)
+
     def test_benc(self):
         l = 'minesesasdasdasdasdasd'.encode()
         enc = apothecary.util.benc.encode(l)
@@ -32,6 +48,19 @@ class TestUtil(unittest.TestCase):
         r = apothecary.util.random.read(16)
         self.assertEqual(len(r), 16)
 
+    def test_entropy_pool(self):
+        pool = apothecary.util.EntropyPool(block_size=64)
+        reads = [pool.read(16) for i in range(10)]
+        self.assertEqual([len(r) for r in reads], [16] * 10)
+        self.assertEqual(len(set(reads)), 10)
+        self.assertEqual(len(pool.read(100)), 100)
+
+    def test_tokens(self):
+        tokens = apothecary.util.tokens(50, 16)
+        self.assertEqual(len(tokens), 50)
+        self.assertEqual(set(len(t) for t in tokens), set([16]))
+        self.assertEqual(len(set(tokens)), 50)
+
     def test_token(self):
         t = apothecary.util.token(16)
         self.assertEqual(len(t), 16)
\ No newline at end of file
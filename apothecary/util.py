@@ -5,12 +5,21 @@ import os
 import time as _time
 import math
 import base64
+import hashlib
 import logging
+import threading
+import collections
+import concurrent.futures
 import sqlalchemy.orm
+import sqlalchemy.event
+import sqlalchemy.types
+import sqlalchemy.sql.functions
+import sqlalchemy.ext.compiler
 import sqlalchemy.ext.declarative
 
 
-__all__ = ('hash', 'benc', 'random', 'time', 'token')
+__all__ = ('hash', 'hash_profile', 'register_hash_profile', 'hash_executor',
+           'set_hash_executor', 'benc', 'random', 'time', 'token', 'tokens')
 
 logger = logging.getLogger(__name__)
 
@@ -25,19 +34,83 @@ except NameError:
     pass # Py3 already.
 
 
+class DigestProfile(object):
+    """Plain message digest of the concatenated args, repeated `rounds`
+    times. Cheap; meant for tokens and securls.
+    """
+    def __init__(self, alg='sha512', rounds=1):
+        self.alg = alg
+        self.rounds = rounds
+        self.digest_length = hashlib.new(alg).digest_size
+
+    def __call__(self, *args):
+        return hashlib.new(self.alg, bytes().join(args) * self.rounds).digest()
+
+
+class Pbkdf2Profile(object):
+    """PBKDF2-HMAC key derivation. The first arg is the secret and any
+    remaining args are joined as the salt.
+    """
+    def __init__(self, alg='sha512', iterations=100000, digest_length=None):
+        self.alg = alg
+        self.iterations = iterations
+        self.digest_length = digest_length or hashlib.new(alg).digest_size
+
+    def __call__(self, secret, *salt):
+        return hashlib.pbkdf2_hmac(self.alg, secret, bytes().join(salt),
+                                   self.iterations, self.digest_length)
+
+
+class ScryptProfile(object):
+    """scrypt key derivation. The first arg is the secret and any
+    remaining args are joined as the salt.
+    """
+    def __init__(self, n=2**14, r=8, p=1, digest_length=64, maxmem=0):
+        self.n = n
+        self.r = r
+        self.p = p
+        self.maxmem = maxmem
+        self.digest_length = digest_length
+
+    def __call__(self, secret, *salt):
+        return hashlib.scrypt(secret, salt=bytes().join(salt), n=self.n,
+                              r=self.r, p=self.p, maxmem=self.maxmem,
+                              dklen=self.digest_length)
+
+
+hash_profiles = {}
+
+
+def register_hash_profile(name, profile):
+    """Register a hash callable under `name`. The callable must have a
+    `digest_length` attribute.
+    """
+    assert callable(profile), "`profile` must be callable."
+    assert hasattr(profile, 'digest_length'), "`profile` requires `digest_length`."
+    hash_profiles[name] = profile
+
+
+def hash_profile(profile):
+    """Resolve a hash profile name to its callable. Callables are
+    returned as is.
+    """
+    if callable(profile):
+        return profile
+    try:
+        return hash_profiles[profile]
+    except KeyError:
+        raise KeyError("Hash profile `%s` is not registered." % profile)
+
+
 try:
     import cryptu.hash
 except ImportError:
     logger.warning("`cryptu` is unavailable. Using less secure hash "
                    "function.")
-    import hashlib
     def hash(*args, **kwa):
+        # Same digest as updating `n` times with every arg.
         n = kwa.get('n', 100)
-        alg = hashlib.sha512()
-        for n in range(n):
-            for arg in args:
-                alg.update(arg)
-        return alg.digest()
+        return hashlib.sha512(bytes().join(args) * n).digest()
     hash.digest_length = 64
 else:
     def hash(*args):
@@ -45,6 +118,56 @@ else:
     hash.digest_length = 64 # SHA512 length
 
 
+register_hash_profile('default', hash)
+register_hash_profile('token', DigestProfile('sha512'))
+register_hash_profile('password', Pbkdf2Profile('sha512'))
+if hasattr(hashlib, 'scrypt'):
+    register_hash_profile('scrypt', ScryptProfile())
+
+
+_hash_executor = None
+_hash_executor_lock = threading.Lock()
+_process_executor = None
+
+
+def set_hash_executor(executor):
+    """Set the executor used for offloaded hashing. Any
+    `concurrent.futures.Executor` works. hashlib releases the GIL for
+    large inputs and its KDFs so a thread pool scales with cores; use a
+    process pool for pure Python hash callables.
+    """
+    global _hash_executor
+    _hash_executor = executor
+
+
+def hash_executor():
+    """Return the executor used for offloaded hashing, creating a
+    thread pool sized to the CPU count on first use.
+    """
+    global _hash_executor
+    if _hash_executor is None:
+        with _hash_executor_lock:
+            if _hash_executor is None:
+                _hash_executor = concurrent.futures.ThreadPoolExecutor(
+                                    max_workers=os.cpu_count() or 1)
+    return _hash_executor
+
+
+def process_executor():
+    """Return a process pool sized to the CPU count, created on first
+    use, for batches of hashing that would serialize on the GIL in a
+    thread pool. (Small inputs to hashlib digests don't release it.)
+    Work sent to it must be picklable.
+    """
+    global _process_executor
+    if _process_executor is None:
+        with _hash_executor_lock:
+            if _process_executor is None:
+                _process_executor = concurrent.futures.ProcessPoolExecutor(
+                                    max_workers=os.cpu_count() or 1)
+    return _process_executor
+
+
 if hasattr(base64, 'b85encode'):
     # Check for py3.
     b85encode = base64.b85encode
@@ -118,27 +241,77 @@ def time():
     return int(_time.time())
 
 
+class epoch_now(sqlalchemy.sql.functions.FunctionElement):
+    """SQL expression for the database's current UNIX time as an
+    integer. The server side counterpart of `time`.
+    """
+    type = sqlalchemy.types.Integer()
+    name = 'epoch_now'
+    inherit_cache = True
+
+
+@sqlalchemy.ext.compiler.compiles(epoch_now)
+def _epoch_now(element, compiler, **kwa):
+    return "CAST(EXTRACT(EPOCH FROM CURRENT_TIMESTAMP) AS INTEGER)"
+
+
+@sqlalchemy.ext.compiler.compiles(epoch_now, 'sqlite')
+def _epoch_now_sqlite(element, compiler, **kwa):
+    return "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+@sqlalchemy.ext.compiler.compiles(epoch_now, 'mysql')
+@sqlalchemy.ext.compiler.compiles(epoch_now, 'mariadb')
+def _epoch_now_mysql(element, compiler, **kwa):
+    return "UNIX_TIMESTAMP()"
+
+
+@sqlalchemy.ext.compiler.compiles(epoch_now, 'mssql')
+def _epoch_now_mssql(element, compiler, **kwa):
+    return "DATEDIFF(second, '1970-01-01', GETUTCDATE())"
+
+
+class EntropyPool(object):
+    """Thread safe buffered reader of kernel entropy. `os.urandom` is
+    read in `block_size` blocks and small reads are served as slices
+    of the buffer. The buffer is discarded in a forked child so parent
+    and child never share bytes.
+    """
+    def __init__(self, block_size=4096):
+        self.block_size = block_size
+        self._after_fork()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._buffer = bytes()
+        self._offset = 0
+
+    def read(self, length):
+        if length >= self.block_size:
+            return os.urandom(length)
+        with self._lock:
+            if self._pid != os.getpid():
+                # No `register_at_fork`. (Py < 3.7)
+                self._pid = os.getpid()
+                self._buffer = bytes()
+                self._offset = 0
+            if len(self._buffer) - self._offset < length:
+                self._buffer = os.urandom(self.block_size)
+                self._offset = 0
+            start = self._offset
+            self._offset += length
+            return self._buffer[start:self._offset]
+
+
 try:
     import cryptu.random as random
 except ImportError:
     logger.warning("`cryptu` is unavailable. Using less secure hash "
                    "function.")
-    import hashlib
-    def read(length):
-        # Don't use for greater than 10,000 bytes.
-        def gen():
-            for i in range(int(math.ceil(length/32.0))):
-                rnd = os.urandom(length*8) # for attempted entropy.
-                yield hashlib.sha256(rnd).digest()
-        if __py3__:
-            return bytes().join(gen())[:length]
-        else:
-            return ''.join(gen())[:length]
-
-    def random():
-        pass
-
-    random.read = read
+    random = EntropyPool()
 
 
 def token(length):
@@ -147,6 +320,13 @@ def token(length):
     #return base64.b64encode(os.urandom(length*2)).encode()[:length]
 
 
+def tokens(n, length):
+    """Return `n` tokens of `length` from a single entropy read.
+    """
+    data = random.read(n * length)
+    return [data[i:i + length] for i in range(0, n * length, length)]
+
+
 def synonym(attr_name, *prop, **kwa):
     """Shortcut for a declarative synonym attribute.
     (*fget, fset, fdel)
@@ -166,18 +346,209 @@ def column(*args, **kwa):
                 sqlalchemy.Column(*args, **kwa))
 
 
-def unique(session, cls, hashfunc, queryfunc, constructor, arg, kw):
+def deferred(*args, **kwa):
+    """Shortcut for a declarative deferred column attribute.
+    `group` names the defer group to load it with.
+    """
+    group = kwa.pop('group', None)
+    return sqlalchemy.ext.declarative.declared_attr(lambda cls:
+                sqlalchemy.orm.deferred(sqlalchemy.Column(*args, **kwa),
+                                        group=group))
+
+
+class Cache(object):
+    """Thread safe LRU cache with an optional TTL in seconds. Counts
+    hits and misses.
+    """
+    def __init__(self, maxsize=1024, ttl=None, timer=_time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self.timer():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            expires = self.ttl and self.timer() + self.ttl
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._evict(next(iter(self._data)))
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def _remove(self, key):
+        del self._data[key]
+
+    def _evict(self, key):
+        self._remove(key)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self),
+                    maxsize=self.maxsize)
+
+
+class UniqueCache(Cache):
+    """`unique` object cache.
+
+    Per session caches hold objects and drop them when the session
+    rolls back or the object is deleted, expunged or made transient.
+    Pending objects are never evicted; a query can't find them until
+    they are flushed, so they are pinned until then.
+    A `shared` cache holds identity keys instead, so it can be used by
+    every session; objects are resolved with `Session.get`.
+    """
+    def __init__(self, maxsize=10000, ttl=None, shared=False):
+        Cache.__init__(self, maxsize=maxsize, ttl=ttl)
+        self.shared = shared
+        self._keys = {}
+        self._pinned = {}
+
+    def lookup(self, session, key):
+        value = self.get(key)
+        if not self.shared:
+            return self._pinned.get(key) if value is None else value
+        if value is None:
+            return value
+        cls, ident, token = value[:3]
+        obj = session.get(cls, ident, identity_token=token)
+        if obj is None:
+            self.discard(key)
+        return obj
+
+    def store(self, key, obj):
+        if self.shared:
+            obj = sqlalchemy.inspect(obj).identity_key
+            if obj is None:
+                return # Pending. Only shared once it has an identity.
+        with self._lock:
+            self._pinned.pop(key, None)
+            self.set(key, obj)
+            if not self.shared:
+                self._keys[id(obj)] = key
+
+    def discard_object(self, obj):
+        with self._lock:
+            key = self._keys.get(id(obj))
+            if key is None:
+                return
+            if key in self._data and self._data[key][0] is obj:
+                self._remove(key)
+            elif self._pinned.get(key) is obj:
+                del self._pinned[key]
+                del self._keys[id(obj)]
+
+    def unpin_flushed(self):
+        """Release pinned objects that have been flushed."""
+        with self._lock:
+            for key, obj in list(self._pinned.items()):
+                if sqlalchemy.inspect(obj).key is not None:
+                    del self._pinned[key]
+                    self._keys.pop(id(obj), None)
+
+    def clear(self):
+        with self._lock:
+            Cache.clear(self)
+            for obj in self._pinned.values():
+                self._keys.pop(id(obj), None)
+            self._pinned.clear()
+
+    def _remove(self, key):
+        value = self._data.pop(key)[0]
+        if not self.shared:
+            self._keys.pop(id(value), None)
+
+    def _evict(self, key):
+        value = self._data[key][0]
+        if not self.shared and sqlalchemy.inspect(value).key is None:
+            del self._data[key]
+            self._pinned[key] = value
+        else:
+            self._remove(key)
+
+
+def unique_cache(session, maxsize=10000):
+    """Return the `UniqueCache` of `session`, creating it and hooking
+    its invalidation events on first use.
+    """
+    if isinstance(session, sqlalchemy.orm.scoped_session):
+        session = session()
+    cache = session.info.get('unique_cache')
+    if cache is None:
+        cache = session.info['unique_cache'] = UniqueCache(maxsize=maxsize)
+
+        def on_rollback(session, previous_transaction):
+            cache.clear()
+
+        def on_remove(session, obj):
+            cache.discard_object(obj)
+
+        def on_flush(session, flush_context):
+            cache.unpin_flushed()
+
+        sqlalchemy.event.listen(session, 'after_soft_rollback', on_rollback)
+        sqlalchemy.event.listen(session, 'after_flush_postexec', on_flush)
+        for event in ('pending_to_transient', 'persistent_to_transient',
+                      'persistent_to_deleted', 'persistent_to_detached'):
+            sqlalchemy.event.listen(session, event, on_remove)
+    return cache
+
+
+def unique(session, cls, hashfunc, queryfunc, constructor, arg, kw,
+           maxsize=10000, shared=None):
     """
     author: Michael Bayer
     src: https://bitbucket.org/zzzeek/sqlalchemy/wiki/UsageRecipes/UniqueObject
+
+    `maxsize` - Bound of the per session cache.
+    `shared` - Optional `UniqueCache(shared=True)` consulted after the
+               per session cache.
     """
-    cache = getattr(session, '_unique_cache', None)
-    if cache is None:
-        session._unique_cache = cache = {}
+    cache = unique_cache(session, maxsize=maxsize)
 
     key = (cls, hashfunc(*arg, **kw))
-    if key in cache:
-        return cache[key]
+    obj = cache.lookup(session, key)
+    if shared is not None:
+        if obj is None:
+            obj = shared.lookup(session, key)
+            if obj is not None:
+                cache.store(key, obj)
+        elif key not in shared:
+            shared.store(key, obj) # Pending when first seen.
+    if obj is not None:
+        return obj
     else:
         with session.no_autoflush:
             q = session.query(cls)
@@ -186,5 +557,168 @@ def unique(session, cls, hashfunc, queryfunc, constructor, arg, kw):
             if not obj:
                 obj = constructor(*arg, **kw)
                 session.add(obj)
-        cache[key] = obj
-        return obj
\ No newline at end of file
+        cache.store(key, obj)
+        if shared is not None:
+            shared.store(key, obj)
+        return obj
+
+
+def _upsert(session, cls, attrs, kws, dialect):
+    """Insert `kws` skipping rows that conflict with existing ones.
+    """
+    mapper = sqlalchemy.inspect(cls)
+    colkeys = [mapper.get_property(attr).columns[0].key for attr in attrs]
+    if dialect.name in ('postgresql', 'sqlite'):
+        insert = __import__('sqlalchemy.dialects.%s' % dialect.name,
+                            fromlist=['insert']).insert
+        stmt = insert(mapper.local_table).on_conflict_do_nothing(
+                    index_elements=colkeys)
+    elif dialect.name in ('mysql', 'mariadb'):
+        stmt = mapper.local_table.insert().prefix_with('IGNORE')
+    else:
+        raise NotImplementedError("Upsert is not supported by `%s`." %
+                                        dialect.name)
+    session.execute(stmt, [dict((colkey, kw[attr])
+                                for colkey, attr in zip(colkeys, attrs))
+                           for kw in kws])
+
+
+def unique_many(session, cls, hashfunc, attrs, constructor, items,
+                chunk_size=None, upsert=False, maxsize=10000, shared=None):
+    """Bulk `unique`. Returns an object for each of `items` in order.
+
+    `items` are dicts of keyword args or tuples of args ordered as
+    `attrs`, the attribute names the unique args are stored in. Cache
+    misses are fetched with one `IN` query per chunk and only keys not
+    found are constructed.
+
+    `chunk_size` - Keys per query. Defaults to what fits in the
+                   dialect's bound parameter limit.
+    `upsert` - Insert misses with the dialect's "on conflict do nothing"
+               before fetching so concurrent writers don't race. Rows
+               are inserted with Core; constructor logic is skipped.
+    """
+    import apothecary.query
+
+    cache = unique_cache(session, maxsize=maxsize)
+    kws = [item if isinstance(item, dict) else dict(zip(attrs, item))
+                for item in items]
+    keys = [(cls, hashfunc(**kw)) for kw in kws]
+
+    # Results are kept here; the bounded cache may evict them.
+    resolved = {}
+    missing = collections.OrderedDict()
+    for key, kw in zip(keys, kws):
+        if key in missing or key in resolved:
+            continue
+        obj = cache.lookup(session, key)
+        if obj is None and shared is not None:
+            obj = shared.lookup(session, key)
+            if obj is not None:
+                cache.store(key, obj)
+        if obj is None:
+            missing[key] = kw
+        else:
+            resolved[key] = obj
+
+    if missing:
+        dialect = session.get_bind(mapper=sqlalchemy.inspect(cls)).dialect
+        size = chunk_size or max(1, apothecary.query.param_limit(dialect) //
+                                        len(attrs))
+        found = {}
+        with session.no_autoflush:
+            for chunk in apothecary.query.chunked(list(missing.values()),
+                                                  size):
+                if upsert is True:
+                    _upsert(session, cls, attrs, chunk, dialect)
+                rows = [tuple(kw[attr] for attr in attrs) for kw in chunk]
+                criterion = apothecary.query.many_criterion(cls, attrs, rows,
+                                                            dialect)
+                for obj in session.query(cls).filter(criterion):
+                    kw = dict((attr, getattr(obj, attr)) for attr in attrs)
+                    found[(cls, hashfunc(**kw))] = obj
+
+            for key, kw in missing.items():
+                obj = found.get(key)
+                if obj is None:
+                    obj = constructor(**kw)
+                    session.add(obj)
+                resolved[key] = obj
+                cache.store(key, obj)
+                if shared is not None:
+                    shared.store(key, obj)
+
+    return [resolved[key] for key in keys]
+
+
+# Callbacks run after a commit that changed rows of a mapped class.
+_commit_callbacks = {}
+_commit_callbacks_lock = threading.Lock()
+
+
+def _changed_classes(session):
+    return session.info.setdefault('changed_classes', set())
+
+
+def _commit_after_flush(session, flush_context):
+    changed = _changed_classes(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        changed.add(obj.__class__)
+
+
+def _commit_orm_execute(orm_execute_state):
+    state = orm_execute_state
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    changed = _changed_classes(state.session)
+    mapper = state.bind_mapper
+    if mapper is not None:
+        changed.add(mapper.class_)
+        return
+    # Core statement on a table; match the registered classes.
+    table = getattr(state.statement, 'table', None)
+    for cls in list(_commit_callbacks):
+        mapper = sqlalchemy.inspect(cls, raiseerr=False)
+        if mapper is not None and table in mapper.tables:
+            changed.add(cls)
+
+
+def _commit_callbacks_of(session):
+    changed = session.info.pop('changed_classes', None)
+    callbacks = set()
+    for cls in changed or ():
+        for base in cls.__mro__:
+            callbacks.update(_commit_callbacks.get(base, ()))
+    return callbacks
+
+
+def _commit_after_commit(session):
+    for callback in _commit_callbacks_of(session):
+        callback()
+
+
+def _commit_after_rollback(session):
+    # Caches may have been filled with the rolled back rows through
+    #   this session, so invalidate them as well.
+    for callback in _commit_callbacks_of(session):
+        callback()
+
+
+def on_commit_change(cls, callback):
+    """Call `callback()` after any session commits changes to rows of
+    `cls` or its subclasses, or rolls them back. Changes are those
+    flushed by the unit of work and INSERT/UPDATE/DELETE statements
+    run through the session.
+    """
+    with _commit_callbacks_lock:
+        if not _commit_callbacks:
+            Session = sqlalchemy.orm.Session
+            sqlalchemy.event.listen(Session, 'after_flush',
+                                    _commit_after_flush)
+            sqlalchemy.event.listen(Session, 'do_orm_execute',
+                                    _commit_orm_execute)
+            sqlalchemy.event.listen(Session, 'after_commit',
+                                    _commit_after_commit)
+            sqlalchemy.event.listen(Session, 'after_rollback',
+                                    _commit_after_rollback)
+        _commit_callbacks.setdefault(cls, set()).add(callback)
@@ -0,0 +1,47 @@
+"""Login throughput for `UserMix.challenge_many` by worker count.
+
+    PYTHONPATH=. python bench/bench_auth.py [logins]
+"""
+import os
+import sys
+import time
+import concurrent.futures
+import sqlalchemy
+import sqlalchemy.types
+import sqlalchemy.ext.declarative
+
+import apothecary.modelmix.auth
+
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+
+class User(Base, apothecary.modelmix.auth.user_mix(passhashfunc='password')):
+    __tablename__ = "bench_user"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+def main(logins=64):
+    users = [User(name=u"user%s" % i) for i in range(logins)]
+    User.set_password_many([(user, u"secret") for user in users])
+    pairs = [(user, u"secret") for user in users]
+
+    start = time.time()
+    for user, password in pairs:
+        user.challenge(password)
+    serial = logins / (time.time() - start)
+    print("serial       %8.1f logins/s" % serial)
+
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            start = time.time()
+            assert all(User.challenge_many(pairs, executor=executor))
+            rate = logins / (time.time() - start)
+        print("%2d workers   %8.1f logins/s  (x%.2f)" % (workers, rate,
+                                                          rate / serial))
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
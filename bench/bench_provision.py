@@ -0,0 +1,47 @@
+"""User creation throughput, one instance at a time vs
+`UserMix.provision`.
+
+    PYTHONPATH=. python bench/bench_provision.py [users]
+"""
+import sys
+import time
+import sqlalchemy
+import sqlalchemy.orm
+import sqlalchemy.types
+import sqlalchemy.ext.declarative
+
+import apothecary.modelmix.auth
+
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+
+class User(Base, apothecary.modelmix.auth.user_mix(passhashfunc='password')):
+    __tablename__ = "bench_provision_user"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+def main(users=500):
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sqlalchemy.orm.Session(engine)
+
+    start = time.time()
+    for i in range(users):
+        user = User(name=u"serial%s" % i)
+        user.password = u"secret"
+        session.add(user)
+    session.commit()
+    serial = users / (time.time() - start)
+    print("instances    %8.1f users/s" % serial)
+
+    start = time.time()
+    User.provision(session, [(u"bulk%s" % i, u"secret")
+                                for i in range(users)], chunk_size=100)
+    session.commit()
+    rate = users / (time.time() - start)
+    print("provision    %8.1f users/s  (x%.2f)" % (rate, rate / serial))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,87 @@
+"""Concurrent `SequenceMix` increments: Python read-modify-write vs
+atomic `UPDATE ... RETURNING`.
+
+    PYTHONPATH=. python bench/bench_sequence.py [writers] [increments] [dburl]
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+import sqlalchemy
+import sqlalchemy.orm
+import sqlalchemy.types
+import sqlalchemy.ext.declarative
+
+import apothecary.modelmix
+
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+
+class Counter(Base, apothecary.modelmix.sequence_mix('sequence')):
+    __tablename__ = "bench_sequence"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+def read_modify_write(obj):
+    obj.sequence = obj.sequence + 1
+
+
+def atomic(obj):
+    obj._sequence_inc()
+
+
+def run(engine, writers, increments, step):
+    Session = sqlalchemy.orm.sessionmaker(bind=engine)
+    session = Session()
+    session.query(Counter).delete()
+    session.add(Counter(id=1, sequence=0))
+    session.commit()
+    session.close()
+
+    errors = []
+
+    def writer():
+        session = Session()
+        for i in range(increments):
+            try:
+                step(session.get(Counter, 1))
+                session.commit()
+            except sqlalchemy.exc.OperationalError:
+                session.rollback() # SQLite "database is locked".
+                errors.append(1)
+        session.close()
+
+    threads = [threading.Thread(target=writer) for i in range(writers)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    session = Session()
+    final = session.get(Counter, 1).sequence
+    session.close()
+    expected = writers * increments - len(errors)
+    return expected / elapsed, expected - final
+
+
+def main(writers=8, increments=200, dburl=None):
+    if dburl is None:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        dburl = "sqlite:///%s" % path
+    engine = sqlalchemy.create_engine(dburl,
+                                      connect_args={'timeout': 30}
+                                      if dburl.startswith('sqlite') else {})
+    Base.metadata.create_all(engine)
+    for label, step in (("read-modify-write", read_modify_write),
+                        ("atomic", atomic)):
+        rate, lost = run(engine, int(writers), int(increments), step)
+        print("%-18s %8.1f inc/s  %5d lost updates" % (label, rate, lost))
+    Base.metadata.drop_all(engine)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,49 @@
+"""Per-request cost of password and securl verification.
+
+    PYTHONPATH=. python bench/bench_verify.py [number]
+"""
+import sys
+import timeit
+import sqlalchemy
+import sqlalchemy.types
+import sqlalchemy.ext.declarative
+
+import apothecary.modelmix.auth
+import apothecary.modelmix.sec
+
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+
+class User(Base, apothecary.modelmix.auth.user_mix()):
+    __tablename__ = "bench_user"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+class Url(Base, apothecary.modelmix.sec.url_token_mix()):
+    __tablename__ = "bench_url"
+    id = sqlalchemy.Column(sqlalchemy.types.Integer, primary_key=True)
+
+
+def main(number=100000):
+    user = User(name=u"user")
+    user.password = u"secret"
+
+    url = Url()
+    url._token_created = apothecary.util.token(8)
+    url._token_updated = apothecary.util.token(8)
+    securl = url.get_securl(b"reset")
+
+    for label, func in (
+            ("challenge (match)", lambda: user.challenge(u"secret")),
+            ("challenge (miss)", lambda: user.challenge(u"wrong")),
+            ("validate_securl (match)",
+                lambda: url.validate_securl(securl, b"reset")),
+            ("validate_securl (miss)",
+                lambda: url.validate_securl(securl, b"other"))):
+        seconds = timeit.timeit(func, number=number)
+        print("%-24s %8.2f us/op" % (label, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])